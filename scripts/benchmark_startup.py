@@ -0,0 +1,131 @@
+"""Cold start benchmark: start the app in a subprocess and measure the time to listen, to be ready and to answer.
+
+The vector store and the LLM must be available as for running the app, e.g.:
+`python -m scripts.benchmark_startup --question "What do cobras eat?"`
+"""
+
+import argparse
+import http.client
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+
+from pydantic import BaseModel
+
+from src.app import PATHS
+from src.config import PROJECT_ROOT_PATH
+from src.logging import logger
+
+_POLL_INTERVAL = 0.05
+_HTTP_OK = 200
+
+
+class StartupReport(BaseModel):
+    import_time: float  # interpreter start and `import src.app`
+    time_to_listen: float
+    time_to_ready: float
+    time_to_first_answer: float
+
+
+def _request(host: str, port: int, method: str, path: str, body: dict | None = None) -> tuple[int, dict]:
+    conn = http.client.HTTPConnection(host=host, port=port, timeout=600)
+    try:
+        conn.request(
+            method=method,
+            url=path,
+            body=json.dumps(body) if body is not None else None,
+            headers={"Content-Type": "application/json"},
+        )
+        resp = conn.getresponse()
+        return resp.status, json.loads(resp.read() or b"{}")
+    finally:
+        conn.close()
+
+
+class _App:
+    def __init__(self, host: str, port: int, timeout: float) -> None:
+        self.host = host
+        self.port = port
+        self.deadline = time.perf_counter() + timeout
+        env = {**os.environ, "DYNACONF_UVICORN__host": host, "DYNACONF_UVICORN__port": str(port)}
+        self.start = time.perf_counter()
+        self.proc = subprocess.Popen([sys.executable, "-m", "src.app"], cwd=PROJECT_ROOT_PATH, env=env)
+
+    def _check_alive(self) -> None:
+        if self.proc.poll() is not None:
+            raise RuntimeError(f"App exited with code {self.proc.returncode}")
+        if time.perf_counter() > self.deadline:
+            raise TimeoutError("App did not start in time")
+
+    def wait_listen(self) -> float:
+        while True:
+            self._check_alive()
+            try:
+                socket.create_connection((self.host, self.port), timeout=1).close()
+                return time.perf_counter() - self.start
+            except OSError:
+                time.sleep(_POLL_INTERVAL)
+
+    def wait_ready(self) -> float:
+        while True:
+            self._check_alive()
+            status_code, content = _request(host=self.host, port=self.port, method="GET", path=PATHS.ready)
+            if status_code == _HTTP_OK:
+                return time.perf_counter() - self.start
+            if content.get("status") == "FAILED":
+                raise RuntimeError(f"App failed to preload: {content.get('error')}")
+            time.sleep(_POLL_INTERVAL)
+
+    def wait_answer(self, question: str) -> float:
+        status_code, content = _request(
+            host=self.host, port=self.port, method="POST", path=PATHS.qa, body={"question": question}
+        )
+        if status_code != _HTTP_OK:
+            raise RuntimeError(f"Failed to answer the first question: {content}")
+        return time.perf_counter() - self.start
+
+    def stop(self) -> None:
+        self.proc.terminate()
+        self.proc.wait()
+
+
+def measure_import_time() -> float:
+    start = time.perf_counter()
+    subprocess.run([sys.executable, "-c", "import src.app"], cwd=PROJECT_ROOT_PATH, check=True)
+    return time.perf_counter() - start
+
+
+def run_benchmark(question: str, host: str = "127.0.0.1", port: int = 8090, timeout: float = 600) -> StartupReport:
+    import_time = measure_import_time()
+    app = _App(host=host, port=port, timeout=timeout)
+    try:
+        time_to_listen = app.wait_listen()
+        time_to_ready = app.wait_ready()
+        time_to_first_answer = app.wait_answer(question=question)
+    finally:
+        app.stop()
+    return StartupReport(
+        import_time=import_time,
+        time_to_listen=time_to_listen,
+        time_to_ready=time_to_ready,
+        time_to_first_answer=time_to_first_answer,
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--question", default="What is this document about?")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--timeout", type=float, default=600, help="seconds to wait for the app to answer")
+    args = parser.parse_args()
+    report = run_benchmark(question=args.question, host=args.host, port=args.port, timeout=args.timeout)
+    logger.info("Startup benchmark: %s", report)
+    sys.stdout.write(report.model_dump_json(indent=2) + "\n")
+
+
+if __name__ == "__main__":
+    main()
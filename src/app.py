@@ -1,42 +1,103 @@
-from collections.abc import Callable
-from typing import Annotated
+import asyncio
+import codecs
+import math
+import re
+import threading
+from collections.abc import AsyncIterator, Awaitable, Callable
+from contextlib import asynccontextmanager, suppress
+from typing import Annotated, Any, Literal
 from uuid import uuid4
 
-import uvicorn
-from fastapi import Depends, FastAPI, HTTPException, Request, UploadFile, status
+from fastapi import Depends, FastAPI, Header, HTTPException, Request, UploadFile, status
+from fastapi.concurrency import run_in_threadpool
 from fastapi.exceptions import RequestValidationError
 from fastapi.responses import JSONResponse, Response
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
+from starlette.types import Message, Receive
 
 from .config import CONFIGS
-from .docs import parse_pdf_file, parse_text
-from .llm import LLMService
+from .docs import ChunkBatch, get_text_splitter, memory_map, parse_pdf_file_batch, parse_text_stream
+from .extractive import ExtractiveAnswerer
+from .llm import GenerationCancelledError, LLMService
 from .logging import logger
-from .vector_store import VectorStore
+from .scheduler import DeadlineExceededError, FairScheduler, OverloadedError, TenantQueueFullError
+from .startup import Preloader
+from .vector_store import (
+    DocumentNotFoundError,
+    DocumentUpdateResult,
+    QuotaExceededError,
+    TenantLimitError,
+    VectorStore,
+)
 
-app = FastAPI()
+
+def _preload_llm() -> None:
+    llm_service = app.dependency_overrides.get(get_llm_service, LLMService)()
+    if CONFIGS.startup.warmup_llm:
+        llm_service.warmup()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI) -> AsyncIterator[None]:
+    if CONFIGS.startup.preload:
+        Preloader().start(
+            loaders={
+                "vector_store": app.dependency_overrides.get(get_vector_store, VectorStore),
+                "text_splitter": lambda: get_text_splitter(tokenizer_file=CONFIGS.docs.tokenizer_file),
+                "llm": _preload_llm,
+            }
+        )
+    yield
+
+
+app = FastAPI(lifespan=lifespan)
 
 IDK_ANSWER = "Unfortunately, I cannot find the answer to the question."
 
+TENANT_HEADER = "X-Tenant-ID"
+# tenant id is used as chromadb collection name
+_TENANT_ID_PATTERN = re.compile(r"^[a-zA-Z0-9][a-zA-Z0-9_-]{1,61}[a-zA-Z0-9]$")
+_MB = 1024 * 1024
+_CLIENT_CLOSED_REQUEST = 499
+_CANCEL_POLL_INTERVAL = 0.1  # seconds between checks for client disconnection and deadline during generation
+
 
 class PATHS:
     health_check = "/health/"
+    ready = "/ready/"
     upload_file = "/upload/"
+    document = "/document/{document_id}/"
     qa = "/qa/"
+    metrics = "/metrics/"
 
 
 class UploadFileResponse(BaseModel):
     document_id: str
 
 
+class UpdateDocumentResponse(DocumentUpdateResult):
+    document_id: str
+
+
+class DeleteDocumentResponse(BaseModel):
+    document_id: str
+    deleted_chunks: int
+
+
+AnswerMode = Literal["auto", "llm", "extractive"]
+
+
 class QAResponse(BaseModel):
     answer: str
     sources: list[str]
+    answer_mode: AnswerMode | None = None
 
 
 class QARequest(BaseModel):
     question: str
     document_ids: list[str] | None = None
+    answer_mode: AnswerMode | None = None  # default to qa.answer_mode config
+    timeout: float | None = Field(default=None, gt=0)  # seconds, default to qa.request_timeout config
 
 
 @app.middleware("http")
@@ -50,17 +111,78 @@ async def handling_exception(request: Request, call_next: Callable) -> Response:
         )
 
 
+def _limit_body_size(receive: Receive, max_size_mb: int) -> Receive:
+    received = 0
+
+    async def _receive() -> Message:
+        nonlocal received
+        message = await receive()
+        received += len(message.get("body", b""))
+        if received > max_size_mb * _MB:
+            raise HTTPException(
+                status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=f"Upload exceeds {max_size_mb} MB"
+            )
+        return message
+
+    return _receive
+
+
+@app.middleware("http")
+async def limit_upload_size(request: Request, call_next: Callable[[Request], Awaitable[Response]]) -> Response:
+    """Reject uploads larger than any size limit from the Content-Length header, before the body is received.
+
+    Without Content-Length (chunked upload) the body is counted while it is received instead.
+    """
+    max_size_mb = max(CONFIGS.docs.max_text_upload_mb, CONFIGS.docs.max_pdf_upload_mb)
+    content_length = request.headers.get("content-length", "")
+    if not content_length.isdigit():
+        return await call_next(Request(request.scope, receive=_limit_body_size(request.receive, max_size_mb)))
+    if int(content_length) > max_size_mb * _MB:
+        return JSONResponse(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, content={"detail": f"Upload exceeds {max_size_mb} MB"}
+        )
+    return await call_next(request)
+
+
 @app.exception_handler(RequestValidationError)
 async def validation_exception_handler(request: Request, exc: RequestValidationError) -> Response:
     return JSONResponse(status_code=status.HTTP_400_BAD_REQUEST, content={"detail": exc.errors()})
 
 
+def get_preloader() -> Preloader:
+    return Preloader()
+
+
 def get_vector_store() -> VectorStore:
-    return VectorStore()
+    return Preloader().load(VectorStore)
 
 
 def get_llm_service() -> LLMService:
-    return LLMService()
+    return Preloader().load(LLMService)
+
+
+def get_scheduler() -> FairScheduler:
+    return FairScheduler()
+
+
+def get_extractive_answerer() -> ExtractiveAnswerer:
+    return ExtractiveAnswerer()
+
+
+def get_tenant(
+    vector_store: Annotated[VectorStore, Depends(get_vector_store)],
+    x_tenant_id: Annotated[str | None, Header(alias=TENANT_HEADER)] = None,
+) -> str:
+    """Return the collection of the requesting tenant, requests without tenant use the default collection"""
+    if x_tenant_id is None:
+        return VectorStore.DEFAULT_COLLECTION_NAME
+    if not _TENANT_ID_PATTERN.match(x_tenant_id) or VectorStore.is_reserved_name(name=x_tenant_id):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Invalid {TENANT_HEADER}: {x_tenant_id}")
+    try:
+        vector_store.ensure_tenant_collection(name=x_tenant_id)
+    except TenantLimitError as e:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail=str(e)) from e
+    return x_tenant_id
 
 
 @app.get(path=PATHS.health_check)
@@ -68,45 +190,212 @@ async def health_check(
     vector_store: Annotated[VectorStore, Depends(get_vector_store)],
     llm_service: Annotated[LLMService, Depends(get_llm_service)],
 ) -> Response:
-    vector_store.chromadb_client.heartbeat()
+    vector_store.heartbeat()
     return JSONResponse(content={"status": "OK"})
 
 
+@app.get(path=PATHS.ready)
+async def ready(preloader: Annotated[Preloader, Depends(get_preloader)]) -> Response:
+    """Readiness probe, not ready until the subsystems are preloaded"""
+    preload_status = preloader.status
+    return JSONResponse(
+        status_code=status.HTTP_200_OK if preload_status == "READY" else status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={"status": preload_status, "load_times": preloader.load_times, "error": preloader.error},
+    )
+
+
+def _check_upload_size(file: UploadFile, max_size_mb: int) -> None:
+    if file.size is not None and file.size > max_size_mb * _MB:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"{file.content_type} upload exceeds {max_size_mb} MB",
+        )
+
+
+def _content_type_charset(content_type_params: str) -> str | None:
+    for param in content_type_params.split(";"):
+        key, _, value = param.partition("=")
+        if key.strip().lower() == "charset":
+            charset = value.strip().strip('"')
+            try:
+                codecs.lookup(charset)
+            except LookupError as e:
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST, detail=f"Unknown charset: {charset}"
+                ) from e
+            return charset
+    return None
+
+
+async def _parse_upload_file(file: UploadFile, doc_id: str) -> ChunkBatch:
+    """Parse the spooled upload without reading it whole in memory: PDF is memory mapped, text is streamed"""
+    content_type = file.content_type or ""
+    media_type, _, params = content_type.partition(";")
+    if media_type == "application/pdf":
+        _check_upload_size(file=file, max_size_mb=CONFIGS.docs.max_pdf_upload_mb)
+        with memory_map(file=file.file) as pdf_stream:
+            return parse_pdf_file_batch(stream=pdf_stream, doc_id=doc_id)
+    if media_type.startswith("text/"):
+        _check_upload_size(file=file, max_size_mb=CONFIGS.docs.max_text_upload_mb)
+        await file.seek(0)
+        return parse_text_stream(stream=file.file, doc_id=doc_id, encoding=_content_type_charset(params))
+    raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Invalid Content-Type: {content_type}")
+
+
 @app.post(path=PATHS.upload_file)
 async def upload_file(
-    file: UploadFile, vector_store: Annotated[VectorStore, Depends(get_vector_store)]
+    file: UploadFile,
+    vector_store: Annotated[VectorStore, Depends(get_vector_store)],
+    tenant: Annotated[str, Depends(get_tenant)],
 ) -> UploadFileResponse:
     doc_id = str(uuid4())
-    content_type = file.content_type
-    if content_type == "application/pdf":
-        doc_chunks = parse_pdf_file(stream=file.file, doc_id=doc_id)
-    elif content_type.startswith("text/"):
-        content = await file.read()
-        doc_chunks = parse_text(text=content.decode(), doc_id=doc_id)
-    else:
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Invalid Content-Type: {content_type}")
-    vector_store.add_multiple_document_chunks(chunks=doc_chunks)
+    doc_chunks = await _parse_upload_file(file=file, doc_id=doc_id)
+    try:
+        vector_store.add_multiple_document_chunks(chunks=doc_chunks, collection_name=tenant)
+    except QuotaExceededError as e:
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=str(e)) from e
     return UploadFileResponse(document_id=doc_id)
 
 
+@app.put(path=PATHS.document)
+async def update_document(
+    document_id: str,
+    file: UploadFile,
+    vector_store: Annotated[VectorStore, Depends(get_vector_store)],
+    tenant: Annotated[str, Depends(get_tenant)],
+) -> UpdateDocumentResponse:
+    doc_chunks = await _parse_upload_file(file=file, doc_id=document_id)
+    try:
+        res = vector_store.update_document_chunks(document_id=document_id, chunks=doc_chunks, collection_name=tenant)
+    except DocumentNotFoundError as e:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=str(e)) from e
+    except QuotaExceededError as e:
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=str(e)) from e
+    return UpdateDocumentResponse(document_id=document_id, **res.model_dump())
+
+
+@app.delete(path=PATHS.document)
+async def delete_document(
+    document_id: str,
+    vector_store: Annotated[VectorStore, Depends(get_vector_store)],
+    tenant: Annotated[str, Depends(get_tenant)],
+) -> DeleteDocumentResponse:
+    try:
+        deleted = vector_store.delete_document(document_id=document_id, collection_name=tenant)
+    except DocumentNotFoundError as e:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=str(e)) from e
+    return DeleteDocumentResponse(document_id=document_id, deleted_chunks=deleted)
+
+
+async def _run_cancellable(request: Request, deadline: float | None, func: Callable, **kwargs: Any) -> Any:
+    """Run `func` in the thread pool with a `cancel` event, set once the client disconnects or the deadline passes"""
+    loop = asyncio.get_running_loop()
+    cancel = threading.Event()
+    task = asyncio.ensure_future(run_in_threadpool(func, cancel=cancel, **kwargs))
+    try:
+        while not task.done():
+            await asyncio.wait({task}, timeout=_CANCEL_POLL_INTERVAL)
+            if task.done() or cancel.is_set():
+                continue
+            if (deadline is not None and loop.time() >= deadline) or await request.is_disconnected():
+                cancel.set()
+    except asyncio.CancelledError:
+        cancel.set()  # do not keep the LLM busy for a cancelled handler
+        # the model is not thread safe, only leave the LLM slot once the generation stopped at its next token
+        while not task.done():
+            with suppress(asyncio.CancelledError):
+                await asyncio.wait({task})
+        if not task.cancelled():
+            task.exception()  # GenerationCancelledError is expected, the handler is cancelled anyway
+        raise
+    return task.result()
+
+
 @app.post(path=PATHS.qa)
-async def qa(
+async def qa(  # noqa: PLR0913
+    request: Request,
     vector_store: Annotated[VectorStore, Depends(get_vector_store)],
     llm_service: Annotated[LLMService, Depends(get_llm_service)],
+    scheduler: Annotated[FairScheduler, Depends(get_scheduler)],
+    extractive_answerer: Annotated[ExtractiveAnswerer, Depends(get_extractive_answerer)],
+    tenant: Annotated[str, Depends(get_tenant)],
     req: QARequest,
 ) -> QAResponse:
-    chunks = vector_store.search(query=req.question, document_ids=req.document_ids)
+    chunks = vector_store.search_batch(query=req.question, document_ids=req.document_ids, collection_name=tenant)
     if not chunks:
         return QAResponse(answer=IDK_ANSWER, sources=[])
-    chunks_texts = [chnk.text for chnk in chunks]
-    answer = llm_service.answer_question_based_on_sources(
-        question=req.question,
-        sources=chunks_texts,
+    chunks_texts = chunks.texts
+
+    answer_mode = req.answer_mode or CONFIGS.qa.answer_mode
+    if answer_mode == "extractive":
+        extracted = extractive_answerer.extract(question=req.question, sources=chunks_texts)
+        answer = extracted.text if extracted else IDK_ANSWER
+        return QAResponse(answer=answer, sources=chunks_texts, answer_mode="extractive")
+    if answer_mode == "auto":
+        extracted = extractive_answerer.answer(question=req.question, sources=chunks_texts)
+        if extracted:
+            return QAResponse(answer=extracted.text, sources=chunks_texts, answer_mode="extractive")
+
+    loop = asyncio.get_running_loop()
+    timeout = req.timeout or CONFIGS.qa.request_timeout
+    deadline = loop.time() + timeout if timeout else None
+    try:
+        async with scheduler.slot(
+            tenant=tenant, deadline=deadline, request_seconds=llm_service.throughput.request_seconds
+        ):
+            answer = await _run_cancellable(
+                request=request,
+                deadline=deadline,
+                func=llm_service.answer_question_based_on_sources,
+                question=req.question,
+                sources=chunks_texts,
+            )
+    except TenantQueueFullError as e:
+        raise HTTPException(status_code=status.HTTP_429_TOO_MANY_REQUESTS, detail=str(e)) from e
+    except OverloadedError as e:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=str(e),
+            headers={"Retry-After": str(math.ceil(e.estimated_wait))},
+        ) from e
+    except DeadlineExceededError as e:
+        raise HTTPException(status_code=status.HTTP_504_GATEWAY_TIMEOUT, detail=str(e)) from e
+    except GenerationCancelledError as e:
+        if deadline is not None and loop.time() >= deadline:
+            raise HTTPException(
+                status_code=status.HTTP_504_GATEWAY_TIMEOUT, detail="Request deadline exceeded while generating"
+            ) from e
+        logger.info("Client disconnected, generation aborted")
+        raise HTTPException(status_code=_CLIENT_CLOSED_REQUEST, detail="Client disconnected") from e
+    return QAResponse(answer=answer, sources=chunks_texts, answer_mode="llm")
+
+
+@app.get(path=PATHS.metrics)
+async def metrics(
+    extractive_answerer: Annotated[ExtractiveAnswerer, Depends(get_extractive_answerer)],
+    vector_store: Annotated[VectorStore, Depends(get_vector_store)],
+    scheduler: Annotated[FairScheduler, Depends(get_scheduler)],
+) -> Response:
+    return JSONResponse(
+        content={
+            "qa": {
+                "auto_mode_questions": extractive_answerer.question_count,
+                "extractive_fast_path": extractive_answerer.fast_path_count,
+                "extractive_fast_path_rate": extractive_answerer.fast_path_rate,
+            },
+            "quantization": vector_store.quantization_report(),
+            "scheduler": {
+                "queued_requests": scheduler.queued_count,
+                "overloaded_rejections": scheduler.overloaded_count,
+                "deadline_exceeded": scheduler.deadline_exceeded_count,
+            },
+        }
     )
-    return QAResponse(answer=answer, sources=chunks_texts)
 
 
 def main() -> None:
+    import uvicorn
+
     uvicorn.run(app, **CONFIGS.uvicorn.model_dump())
 
 
@@ -0,0 +1,86 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from functools import lru_cache
+from pathlib import Path
+from typing import Any
+
+from .logging import get_logger
+
+_FILE_SAMPLE_SIZE = 1 << 20
+
+
+@lru_cache
+def file_fingerprint(path: Path) -> str:
+    """Cheap model file fingerprint: size and the first and last MiB, hashing a multi GB model takes too long"""
+    size = path.stat().st_size
+    digest = hashlib.sha256(str(size).encode())
+    with path.open(mode="rb") as f:
+        digest.update(f.read(_FILE_SAMPLE_SIZE))
+        f.seek(max(size - _FILE_SAMPLE_SIZE, 0))
+        digest.update(f.read(_FILE_SAMPLE_SIZE))
+    return digest.hexdigest()
+
+
+def completion_cache_key(prompt: str, model_fingerprint: str, prompt_configs: dict) -> str:
+    digest = hashlib.sha256()
+    for part in (prompt, model_fingerprint, json.dumps(prompt_configs, sort_keys=True)):
+        digest.update(hashlib.sha256(part.encode()).digest())
+    return digest.hexdigest()
+
+
+class CompletionCache:
+    """Content addressed completion cache in a SQLite file, least recently used entries are evicted above `max_bytes`
+
+    The file can be shared by multiple workers and survives restarts.
+    """
+
+    def __init__(self, path: Path, max_bytes: int) -> None:
+        self.logger = get_logger(self.__class__.__name__)
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS completions ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, last_access INTEGER NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS completions_last_access ON completions(last_access)")
+
+    def get(self, key: str) -> Any | None:
+        with self._lock, self._conn:
+            row = self._conn.execute("SELECT value FROM completions WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            self._conn.execute("UPDATE completions SET last_access = ? WHERE key = ?", (time.time_ns(), key))
+        return json.loads(row[0])
+
+    def put(self, key: str, value: Any) -> None:
+        serialized = json.dumps(value)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO completions (key, value, size, last_access) VALUES (?, ?, ?, ?)",
+                (key, serialized, len(serialized), time.time_ns()),
+            )
+            self._evict()
+
+    def _evict(self) -> None:
+        total_size = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM completions").fetchone()[0]
+        if total_size <= self.max_bytes:
+            return
+        evicted = 0
+        for key, size in self._conn.execute("SELECT key, size FROM completions ORDER BY last_access").fetchall():
+            if total_size <= self.max_bytes:
+                break
+            self._conn.execute("DELETE FROM completions WHERE key = ?", (key,))
+            total_size -= size
+            evicted += 1
+        self.logger.info("Evicted %s completions from %s", evicted, self.path)
+
+    def close(self) -> None:
+        self._conn.close()
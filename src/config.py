@@ -1,7 +1,8 @@
 from pathlib import Path
+from typing import Literal
 
 from dynaconf import Dynaconf
-from pydantic import BaseModel
+from pydantic import BaseModel, field_validator
 
 SRC_PATH = Path(__file__).parent.resolve()
 PROJECT_ROOT_PATH = SRC_PATH.parent
@@ -25,23 +26,96 @@ class ChromaDBConfig(BaseModel):
     database: str
     distance_score_threshold: float
     client_configs: dict
+    shards: list[dict] = []  # client configs of every shard, empty for a single instance with client_configs
+    batch_size: int = 1000
+    compaction_deleted_ratio: float = 0.3
+    compaction_lease_seconds: float = 60
+    quantization: Literal["none", "int8", "binary"] = "none"
+    quantized_index_dir: str = "quantized_index"  # under MODEL_DIR_PATH
+    rescore_factor: int = 8
+    recall_sample_every: int = 0
+
+
+class RetrievalConfig(BaseModel):
+    n_results: int
+    rerank: Literal["none", "mmr"] = "none"
+    fetch_k: int = 30  # candidates fetched before reranking
+    mmr_lambda: float = 0.7  # 1: relevance only, 0: diversity only
+    rerank_cache_size: int = 1024
+
+
+class CompletionCacheConfig(BaseModel):
+    enabled: bool = False
+    path: str = "completion_cache.sqlite3"  # under MODEL_DIR_PATH
+    max_size_mb: int = 512
+    deterministic_only: bool = True  # only cache when sampling is deterministic (temperature = 0)
+
+
+class SpeculativeDecodingConfig(BaseModel):
+    enabled: bool = False
+    drafter: Literal["prompt_lookup", "model"] = "prompt_lookup"
+    num_draft_tokens: int = 10
+    max_ngram_size: int = 3  # prompt_lookup drafter
+    draft_llm_name: str | None = None  # model drafter, must share the main model vocabulary
+    draft_llm_configs: dict = {}
 
 
 class LLMConfig(BaseModel):
     llm_name: str
     llm_configs: dict
     prompt_configs: dict
+    cache: CompletionCacheConfig = CompletionCacheConfig()
+    speculative: SpeculativeDecodingConfig = SpeculativeDecodingConfig()
 
 
 class DocsConfig(BaseModel):
     chunk_capacity: int | tuple[int, int]
+    tokenizer_file: str | None = None  # tokenizer.json under MODEL_DIR_PATH, enable token based splitting
+    split_max_workers: int | None = None
+    pdf_chunking: Literal["page", "document"] = "page"
+    max_text_upload_mb: int = 64
+    max_pdf_upload_mb: int = 256
+    stream_block_size: int = 1 << 20  # bytes
+
+
+class QAConfig(BaseModel):
+    answer_mode: Literal["auto", "llm", "extractive"] = "llm"
+    extractive_confidence_threshold: float = 0.8
+    request_timeout: float | None = 300  # seconds, default deadline of a question
+
+
+class TenancyConfig(BaseModel):
+    max_concurrent_requests: int  # per tenant
+    max_pending_requests: int  # per tenant
+    llm_slots: int
+    max_chunks: int | None = None  # per tenant collection
+    max_tenants: int | None = None
+
+    @field_validator("llm_slots")
+    @classmethod
+    def _single_llm_slot(cls, llm_slots: int) -> int:
+        # every slot would share the same llama model, which is not thread safe
+        if llm_slots != 1:
+            raise ValueError("Only one LLM slot is supported")
+        return llm_slots
+
+
+class StartupConfig(BaseModel):
+    preload: bool = True
+    warmup_llm: bool = True
+    retry_interval: float = 1.0  # seconds, 0 to not retry
+    max_retry_interval: float = 60.0
 
 
 class RootConfig(BaseModel):
     uvicorn: UvicornConfig
     chromadb: ChromaDBConfig
+    retrieval: RetrievalConfig
     llm: LLMConfig
     docs: DocsConfig
+    qa: QAConfig
+    tenancy: TenancyConfig
+    startup: StartupConfig
     log_level: str
 
 
@@ -1,19 +1,55 @@
+import codecs
+import mmap
+from array import array
+from bisect import bisect_right
+from collections.abc import Iterator, Sequence
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import lru_cache
 from pathlib import Path
-from typing import IO, Any
+from typing import IO, TYPE_CHECKING, Any, Literal, cast
 
-from pydantic import BaseModel, ConfigDict
-from pypdf import PdfReader
-from semantic_text_splitter import CharacterTextSplitter
+from pydantic import BaseModel, ConfigDict, model_validator
 
-from .config import CONFIGS
+from .config import CONFIGS, MODEL_DIR_PATH
 from .logging import logger
 
+if TYPE_CHECKING:
+    from semantic_text_splitter import CharacterTextSplitter, HuggingFaceTextSplitter
+
+    TextSplitter = CharacterTextSplitter | HuggingFaceTextSplitter
+
+ChunkCapacity = int | tuple[int, int]
+PdfChunking = Literal["page", "document"]
+
+PAGE_SEPARATOR = "\n\n"
+
+FALLBACK_ENCODING = "cp1252"
+_BOM_ENCODINGS = (  # utf-32 first, its little endian BOM starts with the utf-16 one
+    (codecs.BOM_UTF32_LE, "utf-32"),
+    (codecs.BOM_UTF32_BE, "utf-32"),
+    (codecs.BOM_UTF8, "utf-8-sig"),
+    (codecs.BOM_UTF16_LE, "utf-16"),
+    (codecs.BOM_UTF16_BE, "utf-16"),
+)
+
 
 class DocumentChunkMetadata(BaseModel):
     model_config = ConfigDict(extra="allow")
 
     page: int
     document_id: str
+    page_start: int | None = None
+    page_end: int | None = None
+
+    @model_validator(mode="after")
+    def _default_page_span(self) -> "DocumentChunkMetadata":
+        # chromadb does not accept None metadata value, single page chunk spans its own page
+        if self.page_start is None:
+            self.page_start = self.page
+        if self.page_end is None:
+            self.page_end = self.page_start
+        return self
 
 
 class DocumentChunk(BaseModel):
@@ -22,64 +58,250 @@ class DocumentChunk(BaseModel):
     metadata: DocumentChunkMetadata
 
 
+class ChunkBatch:
+    """Columnar chunks of one document, used internally instead of validating a `DocumentChunk` per chunk.
+
+    The document metadata is shared by all the chunks, pages are kept in compact integer arrays.
+    """
+
+    __slots__ = ("document_id", "doc_metadata", "ids", "texts", "page_starts", "page_ends")
+
+    def __init__(self, document_id: str, doc_metadata: dict[str, Any] | None = None) -> None:
+        self.document_id = document_id
+        self.doc_metadata = dict(doc_metadata or {})
+        self.ids: list[str] = []
+        self.texts: list[str] = []
+        self.page_starts = array("i")
+        self.page_ends = array("i")
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def append(self, chunk_id: str, text: str, page_start: int, page_end: int | None = None) -> None:
+        self.ids.append(chunk_id)
+        self.texts.append(text)
+        self.page_starts.append(page_start)
+        self.page_ends.append(page_start if page_end is None else page_end)
+
+    def metadatas(self) -> list[dict[str, Any]]:
+        """Flat per chunk metadata, same keys as `DocumentChunkMetadata.model_dump()`"""
+        shared = {**self.doc_metadata, "document_id": self.document_id}
+        return [
+            {**shared, "page": page_start, "page_start": page_start, "page_end": page_end}
+            for page_start, page_end in zip(self.page_starts, self.page_ends, strict=True)
+        ]
+
+    def to_document_chunks(self) -> list[DocumentChunk]:
+        return [
+            DocumentChunk(id=c_id, text=text, metadata=DocumentChunkMetadata(**meta))
+            for c_id, text, meta in zip(self.ids, self.texts, self.metadatas(), strict=True)
+        ]
+
+
 def _text_truncate(text: str, max_length: int = 100) -> str:
     return text if len(text) < max_length else f"{text[:100]}..."
 
 
-def split_text(text: str) -> list[str]:
-    txt_splitter = CharacterTextSplitter(trim_chunks=True)
-    chunk_capacity = CONFIGS.docs.chunk_capacity
+@lru_cache
+def get_text_splitter(tokenizer_file: str | None = None) -> "TextSplitter":
+    """Return a shared splitter, counting characters or, if `tokenizer_file` is given, the LLM tokens"""
+    # imported on first use, the splitter is preloaded at startup
+    from semantic_text_splitter import CharacterTextSplitter, HuggingFaceTextSplitter
+
+    if tokenizer_file is None:
+        return CharacterTextSplitter(trim_chunks=True)
+    try:
+        return HuggingFaceTextSplitter.from_file(str(MODEL_DIR_PATH / tokenizer_file), trim_chunks=True)
+    except Exception as e:
+        logger.exception("Failed to load tokenizer %s: %s", tokenizer_file, e)
+        raise DocumentParsingError(f"Failed to load tokenizer {tokenizer_file}") from e
+
+
+def split_text(text: str, chunk_capacity: ChunkCapacity | None = None) -> list[str]:
+    txt_splitter = get_text_splitter(tokenizer_file=CONFIGS.docs.tokenizer_file)
+    chunk_capacity = chunk_capacity or CONFIGS.docs.chunk_capacity
     try:
-        return txt_splitter.chunks(text=text, chunk_capacity=chunk_capacity)  # type: ignore
+        return txt_splitter.chunks(text=text, chunk_capacity=chunk_capacity)
     except Exception as e:
         logger.exception("Failed to split text %s into chunk(%s): %s", _text_truncate(text=text), chunk_capacity, e)
         raise DocumentParsingError("Failed to split text into chunks") from e
 
 
+def split_texts(
+    texts: Sequence[str], chunk_capacity: ChunkCapacity | None = None, max_workers: int | None = None
+) -> list[list[str]]:
+    """Split multiple texts (pages or documents) concurrently, results are in the same order as `texts`"""
+    max_workers = max_workers or CONFIGS.docs.split_max_workers
+    if len(texts) <= 1 or max_workers == 1:
+        return [split_text(text=text, chunk_capacity=chunk_capacity) for text in texts]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(lambda text: split_text(text=text, chunk_capacity=chunk_capacity), texts))
+
+
 def _generate_chunk_id(doc_id: str, page_idx: int, chunk_idx: int) -> str:
     return f"{doc_id}_p{page_idx}_c{chunk_idx}"
 
 
-def parse_pdf_file(stream: str | IO[Any] | Path, doc_id: str) -> list[DocumentChunk]:
+def _chunk_starts(text: str, chunks_txt: list[str]) -> list[int]:
+    """Offset of each chunk in `text`, chunks are trimmed, in order, substrings of the text"""
+    starts = []
+    cursor = 0
+    for chunk_txt in chunks_txt:
+        chunk_start = text.find(chunk_txt, cursor)
+        if chunk_start < 0:
+            chunk_start = cursor
+        starts.append(chunk_start)
+        cursor = chunk_start + len(chunk_txt)
+    return starts
+
+
+def _split_pages_across_boundaries(pages_txt: list[str]) -> list[tuple[str, int, int]]:
+    """Split the pages as one text, return chunks with the index of their first and last page"""
+    page_offsets = []
+    offset = 0
+    for page_txt in pages_txt:
+        page_offsets.append(offset)
+        offset += len(page_txt) + len(PAGE_SEPARATOR)
+    doc_txt = PAGE_SEPARATOR.join(pages_txt)
+
+    chunks_txt = split_text(text=doc_txt)
+    chunks = []
+    for chunk_txt, chunk_start in zip(chunks_txt, _chunk_starts(text=doc_txt, chunks_txt=chunks_txt), strict=True):
+        chunk_end = chunk_start + max(len(chunk_txt), 1) - 1
+        chunks.append(
+            (chunk_txt, bisect_right(page_offsets, chunk_start) - 1, bisect_right(page_offsets, chunk_end) - 1)
+        )
+    return chunks
+
+
+def parse_pdf_file_batch(stream: str | IO[Any] | Path, doc_id: str, chunking: PdfChunking | None = None) -> ChunkBatch:
+    """Parse PDF into chunks, either split each page independently or the whole document across page boundaries"""
+    from pypdf import PdfReader
+
     logger.info("Parsing PDF stream")
+    chunking = chunking or CONFIGS.docs.pdf_chunking
 
-    doc_chunks = []
     try:
         reader = PdfReader(stream)
     except Exception as e:
         logger.exception("Failed to init PdfReader: %s", e)
         raise DocumentParsingError("Failed to parse PDF file") from e
-    doc_meta = reader.metadata
+    batch = ChunkBatch(document_id=doc_id, doc_metadata=reader.metadata)
 
+    pages_txt = []
     for page_idx, page in enumerate(reader.pages):
         try:
-            page_txt = page.extract_text()
+            pages_txt.append(page.extract_text())
         except Exception as e:
             logger.exception("Failed to parse page %s: %s", page_idx, e)
             raise DocumentParsingError(f"Failed to parse page {page_idx}") from e
-        doc_chunks += [
-            DocumentChunk(
-                id=_generate_chunk_id(doc_id=doc_id, page_idx=page_idx, chunk_idx=chunk_idx),
-                text=chunk_txt,
-                metadata=DocumentChunkMetadata(document_id=doc_id, page=page_idx, **doc_meta),
-            )
-            for chunk_idx, chunk_txt in enumerate(split_text(text=page_txt))
-        ]
 
-    return doc_chunks
+    if chunking == "document":
+        for chunk_idx, (chunk_txt, page_start, page_end) in enumerate(
+            _split_pages_across_boundaries(pages_txt=pages_txt)
+        ):
+            chunk_id = _generate_chunk_id(doc_id=doc_id, page_idx=page_start, chunk_idx=chunk_idx)
+            batch.append(chunk_id=chunk_id, text=chunk_txt, page_start=page_start, page_end=page_end)
+        return batch
 
+    for page_idx, page_chunks_txt in enumerate(split_texts(texts=pages_txt)):
+        for chunk_idx, chunk_txt in enumerate(page_chunks_txt):
+            chunk_id = _generate_chunk_id(doc_id=doc_id, page_idx=page_idx, chunk_idx=chunk_idx)
+            batch.append(chunk_id=chunk_id, text=chunk_txt, page_start=page_idx)
+    return batch
 
-def parse_text(text: str, doc_id: str) -> list[DocumentChunk]:
+
+def parse_pdf_file(
+    stream: str | IO[Any] | Path, doc_id: str, chunking: PdfChunking | None = None
+) -> list[DocumentChunk]:
+    return parse_pdf_file_batch(stream=stream, doc_id=doc_id, chunking=chunking).to_document_chunks()
+
+
+def parse_text_batch(text: str, doc_id: str) -> ChunkBatch:
     logger.info("Parsing text")
     page_idx = 1
-    return [
-        DocumentChunk(
-            id=_generate_chunk_id(doc_id=doc_id, page_idx=page_idx, chunk_idx=chunk_idx),
+    batch = ChunkBatch(document_id=doc_id)
+    for chunk_idx, chunk_txt in enumerate(split_text(text=text)):
+        batch.append(
+            chunk_id=_generate_chunk_id(doc_id=doc_id, page_idx=page_idx, chunk_idx=chunk_idx),
             text=chunk_txt,
-            metadata=DocumentChunkMetadata(document_id=doc_id, page=page_idx),
+            page_start=page_idx,
         )
-        for chunk_idx, chunk_txt in enumerate(split_text(text=text))
-    ]
+    return batch
+
+
+def parse_text(text: str, doc_id: str) -> list[DocumentChunk]:
+    return parse_text_batch(text=text, doc_id=doc_id).to_document_chunks()
+
+
+def detect_encoding(sample: bytes) -> str:
+    """Encoding of the BOM if any, else UTF-8 if the sample is valid UTF-8, else `FALLBACK_ENCODING`"""
+    for bom, encoding in _BOM_ENCODINGS:
+        if sample.startswith(bom):
+            return encoding
+    try:
+        codecs.getincrementaldecoder("utf-8")().decode(sample, final=False)  # sample can end mid character
+    except UnicodeDecodeError:
+        return FALLBACK_ENCODING
+    return "utf-8"
+
+
+def parse_text_stream(
+    stream: IO[bytes], doc_id: str, encoding: str | None = None, block_size: int | None = None
+) -> ChunkBatch:
+    """Decode and split the text by blocks of `block_size` bytes, the encoding is detected from the first block.
+
+    Only the text of the current block and of the last chunk of the previous block, which may continue in the current
+    block, are kept in memory.
+    """
+    logger.info("Parsing text stream")
+    block_size = block_size or CONFIGS.docs.stream_block_size
+    page_idx = 1
+    batch = ChunkBatch(document_id=doc_id)
+
+    block = stream.read(block_size)
+    encoding = encoding or detect_encoding(sample=block)
+    try:
+        decoder = codecs.getincrementaldecoder(encoding)(errors="replace")
+    except LookupError as e:
+        logger.exception("Unknown text encoding %s: %s", encoding, e)
+        raise DocumentParsingError(f"Unknown text encoding {encoding}") from e
+
+    pending = ""
+    while True:
+        final = not block
+        pending += decoder.decode(block, final=final)
+        chunks_txt = split_text(text=pending) if pending.strip() else []
+        if not final:
+            if len(chunks_txt) <= 1:
+                block = stream.read(block_size)
+                continue
+            # the last chunk may continue in the next block, split it again with the next block
+            pending = pending[_chunk_starts(text=pending, chunks_txt=chunks_txt)[-1] :]
+            chunks_txt = chunks_txt[:-1]
+        for chunk_txt in chunks_txt:
+            batch.append(
+                chunk_id=_generate_chunk_id(doc_id=doc_id, page_idx=page_idx, chunk_idx=len(batch)),
+                text=chunk_txt,
+                page_start=page_idx,
+            )
+        if final:
+            return batch
+        block = stream.read(block_size)
+
+
+@contextmanager
+def memory_map(file: IO[bytes]) -> Iterator[IO[bytes]]:
+    """Read only memory map of a file, an in memory spooled temporary file is rolled over to disk first"""
+    try:
+        fd = file.fileno()
+        file.flush()
+        mapped = mmap.mmap(fd, 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError) as e:
+        logger.exception("Failed to memory map file: %s", e)
+        raise DocumentParsingError("Failed to memory map file") from e
+    with mapped:
+        yield cast(IO[bytes], mapped)  # file like: read, seek and tell as PdfReader uses
 
 
 class DocumentParsingError(Exception):
@@ -0,0 +1,235 @@
+import hashlib
+import json
+import statistics
+import threading
+import time
+from collections.abc import Generator, Sequence
+from pathlib import Path
+from queue import Full, Queue
+
+from pydantic import BaseModel
+
+from .cache import file_fingerprint
+from .config import MODEL_DIR_PATH
+from .llm import LLMOutput, LLMService
+from .logging import get_logger
+from .prompts import EvaluationPrompt
+
+
+class EvaluationCase(BaseModel):
+    id: str  # noqa: A003
+    question: str
+    sources: list[str]
+    reference: str
+
+    def content_hash(self) -> str:
+        return hashlib.sha256(self.model_dump_json().encode()).hexdigest()[:16]
+
+
+class EvaluationResult(BaseModel):
+    case_id: str
+    case_hash: str = ""  # empty in checkpoints written before case hashing, never reused
+    fingerprint: str
+    answer: str
+    evaluation: str
+    correct: bool
+    answer_latency: float
+    grade_latency: float
+    prompt_tokens: int
+    completion_tokens: int
+
+
+class EvaluationReport(BaseModel):
+    count: int
+    accuracy: float
+    answer_latency_mean: float
+    answer_latency_p95: float
+    grade_latency_mean: float
+    prompt_tokens: int
+    completion_tokens: int
+    completion_tokens_per_sec: float
+
+
+def parse_evaluation_result(result: str) -> bool:
+    if "INCORRECT" in result:
+        return False
+    if "CORRECT" in result:
+        return True
+    return False
+
+
+def _percentile(values: Sequence[float], pct: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * pct), len(ordered) - 1)]
+
+
+class EvaluationRunner:
+    """Answer then grade evaluation cases as a two stage pipeline.
+
+    Answers are generated in a background thread while the previous answers are graded, with at most `batch_size`
+    answers waiting to be graded. Each graded result is appended to the `checkpoint_path` JSONL file so an interrupted
+    run resumes from where it stopped. Results of an edited case, another model file, prompt template or configs are not
+    reused.
+    """
+
+    STOP_POLL_INTERVAL = 0.1  # seconds the answer stage waits for room in the queue before checking it is stopped
+
+    def __init__(
+        self,
+        llm_service: LLMService,
+        checkpoint_path: Path | None = None,
+        grader: LLMService | None = None,
+        batch_size: int = 8,
+    ) -> None:
+        self.logger = get_logger(self.__class__.__name__)
+        self.llm_service = llm_service
+        self.grader = grader or llm_service
+        self.checkpoint_path = checkpoint_path
+        self.batch_size = batch_size
+        self.evaluation_prompt = EvaluationPrompt()
+        self.fingerprint = self._fingerprint()
+        # llama model is not thread safe, stages only run concurrently on different models
+        self._answer_lock = threading.Lock()
+        self._grade_lock = self._answer_lock if self.grader is self.llm_service else threading.Lock()
+
+    @staticmethod
+    def _model_fingerprint(svc: LLMService) -> str | None:
+        model_path = MODEL_DIR_PATH / svc.cfg.llm_name
+        return file_fingerprint(path=model_path) if model_path.is_file() else None
+
+    def _fingerprint(self) -> str:
+        services = [
+            {
+                "cfg": svc.cfg.model_dump(),
+                "model": self._model_fingerprint(svc=svc),
+                "qa_prompt": svc.qa_prompt.template,
+            }
+            for svc in (self.llm_service, self.grader)
+        ]
+        fingerprint = {"services": services, "evaluation_prompt": self.evaluation_prompt.template}
+        return hashlib.sha256(json.dumps(fingerprint, sort_keys=True, default=str).encode()).hexdigest()[:16]
+
+    def load_checkpoint(self) -> dict[tuple[str, str], EvaluationResult]:
+        """Checkpointed results of the current fingerprint, keyed by case id and content hash"""
+        if not self.checkpoint_path or not self.checkpoint_path.exists():
+            return {}
+        results = {}
+        with self.checkpoint_path.open() as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                res = EvaluationResult.model_validate_json(line)
+                if res.fingerprint == self.fingerprint:
+                    results[(res.case_id, res.case_hash)] = res
+        self.logger.info("Resume %s results from checkpoint %s", len(results), self.checkpoint_path)
+        return results
+
+    def _answer(self, case: EvaluationCase) -> tuple[LLMOutput, float]:
+        with self._answer_lock:
+            start = time.perf_counter()
+            out = self.llm_service.generate_answer(question=case.question, sources=case.sources)
+            return out, time.perf_counter() - start
+
+    def _grade(self, case: EvaluationCase, answer: LLMOutput, answer_latency: float) -> EvaluationResult:
+        with self._grade_lock:
+            start = time.perf_counter()
+            evaluation = self.grader.generate(
+                prompt=self.evaluation_prompt,
+                prompt_inputs={
+                    EvaluationPrompt.INPUT_QUESTION_KEY: case.question,
+                    EvaluationPrompt.INPUT_ANSWER_KEY: answer.text,
+                    EvaluationPrompt.INPUT_REFERENCE_ANSWER_KEY: case.reference,
+                },
+            )
+            grade_latency = time.perf_counter() - start
+        return EvaluationResult(
+            case_id=case.id,
+            case_hash=case.content_hash(),
+            fingerprint=self.fingerprint,
+            answer=answer.text,
+            evaluation=evaluation.text,
+            correct=parse_evaluation_result(result=evaluation.text),
+            answer_latency=answer_latency,
+            grade_latency=grade_latency,
+            prompt_tokens=answer.prompt_tokens + evaluation.prompt_tokens,
+            completion_tokens=answer.completion_tokens + evaluation.completion_tokens,
+        )
+
+    def iter_results(self, cases: Sequence[EvaluationCase]) -> Generator[EvaluationResult, None, None]:
+        """Yield the result of every case in order, checkpointed results are yielded without running the model"""
+        done = self.load_checkpoint()
+        case_keys = [(case.id, case.content_hash()) for case in cases]
+        todo = [case for case, key in zip(cases, case_keys, strict=True) if key not in done]
+        answers: Queue[tuple[EvaluationCase, LLMOutput, float] | BaseException | None] = Queue(maxsize=self.batch_size)
+        stop = threading.Event()  # set once the results are no longer consumed
+
+        def _put(item: tuple[EvaluationCase, LLMOutput, float] | BaseException | None) -> bool:
+            while not stop.is_set():
+                try:
+                    answers.put(item, timeout=self.STOP_POLL_INTERVAL)
+                    return True
+                except Full:
+                    continue
+            return False
+
+        def _answer_stage() -> None:
+            try:
+                for case in todo:
+                    if stop.is_set() or not _put((case, *self._answer(case=case))):
+                        return
+            except BaseException as e:  # propagate to the grading stage
+                _put(e)
+                return
+            _put(None)
+
+        answer_thread = threading.Thread(target=_answer_stage, name="evaluation_answer", daemon=True)
+        answer_thread.start()
+        try:
+            for key in case_keys:
+                if key in done:
+                    yield done[key]
+                    continue
+                item = answers.get()
+                if isinstance(item, BaseException):
+                    raise item
+                if item is None:
+                    raise RuntimeError("Answer stage stopped before all cases were answered")
+                answered_case, answer, answer_latency = item
+                res = self._grade(case=answered_case, answer=answer, answer_latency=answer_latency)
+                self._checkpoint(result=res)
+                yield res
+        finally:
+            # also when the caller stops iterating early, wait for the current answer so the model is released
+            stop.set()
+            answer_thread.join()
+
+    def _checkpoint(self, result: EvaluationResult) -> None:
+        if not self.checkpoint_path:
+            return
+        self.checkpoint_path.parent.mkdir(parents=True, exist_ok=True)
+        with self.checkpoint_path.open(mode="a") as f:
+            f.write(result.model_dump_json() + "\n")
+
+    def run(self, cases: Sequence[EvaluationCase]) -> tuple[list[EvaluationResult], EvaluationReport]:
+        results = list(self.iter_results(cases=cases))
+        report = summarize_results(results=results)
+        self.logger.info("Evaluation report: %s", report)
+        return results, report
+
+
+def summarize_results(results: Sequence[EvaluationResult]) -> EvaluationReport:
+    if not results:
+        raise ValueError("No evaluation result to summarize")
+    answer_latencies = [res.answer_latency for res in results]
+    generation_time = sum(res.answer_latency + res.grade_latency for res in results)
+    completion_tokens = sum(res.completion_tokens for res in results)
+    return EvaluationReport(
+        count=len(results),
+        accuracy=sum(res.correct for res in results) / len(results),
+        answer_latency_mean=statistics.fmean(answer_latencies),
+        answer_latency_p95=_percentile(answer_latencies, pct=0.95),
+        grade_latency_mean=statistics.fmean(res.grade_latency for res in results),
+        prompt_tokens=sum(res.prompt_tokens for res in results),
+        completion_tokens=completion_tokens,
+        completion_tokens_per_sec=completion_tokens / generation_time if generation_time else 0.0,
+    )
@@ -0,0 +1,96 @@
+import math
+import re
+from collections import Counter
+
+from pydantic import BaseModel
+
+from .config import CONFIGS
+from .logging import get_logger
+from .singleton import ThreadUnsafeSingletonMeta
+
+_SENTENCE_BOUNDARY = re.compile(r"(?<=[.!?])(?:\[[^\]]*\])*\s+")  # drop trailing citations, e.g.: "[1]"
+_WHITESPACES = re.compile(r"\s+")
+_WORD = re.compile(r"\w+")
+_YES_NO_QUESTION = re.compile(
+    r"^\s*(is|are|was|were|am|do|does|did|can|could|will|would|shall|should|has|have|had|may|might|must)\b",
+    re.IGNORECASE,
+)
+_STOPWORDS = frozenset(
+    "a an the of in on at to for from by with and or but is are was were be been being am do does did what which who "
+    "whom whose when where why how that this these those it its as into than then there their they them he she his "
+    "her i you we our your not no can could will would shall should may might must has have had".split()
+)
+
+
+class ExtractiveAnswer(BaseModel):
+    text: str
+    confidence: float
+
+
+_MIN_STEM_LENGTH = 4
+
+
+def _stem(word: str) -> str:
+    # plural/third person, enough to match "live" with "lives"
+    return word[:-1] if len(word) >= _MIN_STEM_LENGTH and word.endswith("s") and not word.endswith("ss") else word
+
+
+def _terms(text: str) -> list[str]:
+    return [_stem(word) for word in _WORD.findall(text.lower()) if word not in _STOPWORDS]
+
+
+class ExtractiveAnswerer(metaclass=ThreadUnsafeSingletonMeta):
+    """Answer with the best matching sentence of the retrieved chunks, without running the LLM.
+
+    Sentences are scored by the IDF weighted share of the question terms they contain (IDF over the sentences of the
+    retrieved chunks), earlier chunks are slightly preferred. Yes/no questions are left to the LLM.
+    """
+
+    RANK_DECAY = 0.05
+
+    def __init__(self) -> None:
+        self.logger = get_logger(self.__class__.__name__)
+        self.confidence_threshold = CONFIGS.qa.extractive_confidence_threshold
+        self.question_count = 0
+        self.fast_path_count = 0
+
+    @property
+    def fast_path_rate(self) -> float:
+        return self.fast_path_count / self.question_count if self.question_count else 0.0
+
+    def extract(self, question: str, sources: list[str]) -> ExtractiveAnswer | None:
+        question_terms = set(_terms(question))
+        if not question_terms or _YES_NO_QUESTION.match(question):
+            return None
+        sentences = [
+            (rank, sent) for rank, src in enumerate(sources) for sent in _SENTENCE_BOUNDARY.split(src) if sent.strip()
+        ]
+        if not sentences:
+            return None
+        sentences_terms = [set(_terms(sent)) for _, sent in sentences]
+        doc_freq = Counter(term for terms in sentences_terms for term in terms & question_terms)
+        idf = {term: math.log(1 + len(sentences) / (1 + doc_freq[term])) for term in question_terms}
+        total_weight = sum(idf.values())
+
+        best: ExtractiveAnswer | None = None
+        for (rank, sent), terms in zip(sentences, sentences_terms, strict=True):
+            if not terms - question_terms:  # only repeat the question
+                continue
+            coverage = sum(idf[term] for term in terms & question_terms) / total_weight
+            confidence = coverage * (1 - self.RANK_DECAY * rank)
+            if best is None or confidence > best.confidence:
+                best = ExtractiveAnswer(text=_WHITESPACES.sub(" ", sent).strip(), confidence=confidence)
+        return best
+
+    def answer(self, question: str, sources: list[str]) -> ExtractiveAnswer | None:
+        """Return the extracted answer if confident enough, `None` to fall back to the LLM"""
+        self.question_count += 1
+        extracted = self.extract(question=question, sources=sources)
+        if extracted is None or extracted.confidence < self.confidence_threshold:
+            self.logger.debug("Extractive answer %s under threshold, fallback to LLM", extracted)
+            return None
+        self.fast_path_count += 1
+        self.logger.info(
+            "Extractive answer with confidence %.2f, fast path rate %.2f", extracted.confidence, self.fast_path_rate
+        )
+        return extracted
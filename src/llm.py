@@ -1,50 +1,199 @@
 import re
+import threading
+import time
+from pathlib import Path
 
-from llama_cpp import Llama
+from pydantic import BaseModel
 
+from .cache import CompletionCache, completion_cache_key, file_fingerprint
 from .config import CONFIGS, MODEL_DIR_PATH
 from .logging import get_logger
 from .prompts import Prompt, QAPrompt
 from .singleton import ThreadUnsafeSingletonMeta
+from .speculative import Drafter, LlamaDrafter, PromptLookupDrafter, SpeculativeDecoder
+
+
+class GenerationCancelledError(Exception):
+    def __init__(self) -> None:
+        super().__init__("Generation cancelled")
+
+
+class ThroughputMeter:
+    """Moving averages of the generation speed and length, to estimate how long a request keeps the LLM busy"""
+
+    SMOOTHING = 0.2  # weight of the latest generation
+
+    def __init__(self) -> None:
+        self.tokens_per_second: float | None = None
+        self.completion_tokens: float | None = None
+
+    def _smooth(self, average: float | None, value: float) -> float:
+        return value if average is None else (1 - self.SMOOTHING) * average + self.SMOOTHING * value
+
+    def record(self, completion_tokens: int, seconds: float) -> None:
+        if completion_tokens <= 0 or seconds <= 0:
+            return
+        self.tokens_per_second = self._smooth(self.tokens_per_second, completion_tokens / seconds)
+        self.completion_tokens = self._smooth(self.completion_tokens, completion_tokens)
+
+    @property
+    def request_seconds(self) -> float | None:
+        """Expected generation time of a request, `None` until a generation is observed"""
+        if self.tokens_per_second is None or self.completion_tokens is None:
+            return None
+        return self.completion_tokens / self.tokens_per_second
+
+
+class LLMOutput(BaseModel):
+    text: str
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
 
 
 class LLMService(metaclass=ThreadUnsafeSingletonMeta):
+    WARMUP_PROMPT = "Hello"
+
     def __init__(self) -> None:
+        from llama_cpp import Llama  # slow import, only when the model is loaded
+
         self.logger = get_logger(self.__class__.__name__)
         self.cfg = CONFIGS.llm
+        model_path = MODEL_DIR_PATH / self.cfg.llm_name
+        llm_configs = self.cfg.llm_configs
+        if self.cfg.speculative.enabled:
+            llm_configs = {**llm_configs, "logits_all": True}  # verify all drafted tokens in one evaluation
         try:
-            self.llm = Llama(model_path=str(MODEL_DIR_PATH / self.cfg.llm_name), **self.cfg.llm_configs)
+            self.llm = Llama(model_path=str(model_path), **llm_configs)
         except Exception as e:
             self.logger.exception("Failed to initiate model %s: %s", self.cfg.llm_name, e)
         self.qa_prompt = QAPrompt()
+        self.throughput = ThroughputMeter()
+        self.completion_cache = self._init_completion_cache(model_path=model_path)
+        self.speculative_decoder = self._init_speculative_decoder()
+
+    def _init_speculative_decoder(self) -> SpeculativeDecoder | None:
+        from llama_cpp import Llama
+
+        spec_cfg = self.cfg.speculative
+        if not spec_cfg.enabled:
+            return None
+        drafter: Drafter
+        try:
+            if spec_cfg.drafter == "model":
+                if not spec_cfg.draft_llm_name:
+                    raise ValueError("Missing draft_llm_name for model drafter")
+                drafter = LlamaDrafter(
+                    llm=Llama(model_path=str(MODEL_DIR_PATH / spec_cfg.draft_llm_name), **spec_cfg.draft_llm_configs)
+                )
+            else:
+                drafter = PromptLookupDrafter(max_ngram_size=spec_cfg.max_ngram_size)
+            return SpeculativeDecoder(llm=self.llm, drafter=drafter, num_draft_tokens=spec_cfg.num_draft_tokens)
+        except Exception as e:
+            self.logger.exception("Failed to initiate speculative decoding, fallback to normal decoding: %s", e)
+            return None
+
+    def _generate_completion(self, formatted_prompt: str, cancel: threading.Event | None = None) -> dict:
+        """Generate without the cache, raise `GenerationCancelledError` if `cancel` is set before it finishes"""
+        from llama_cpp import StoppingCriteriaList
+
+        if cancel is not None and cancel.is_set():  # cancelled while waiting for a thread
+            raise GenerationCancelledError
+        start = time.perf_counter()
+        if self.speculative_decoder is not None:
+            llm_out = self.speculative_decoder.create_completion(
+                prompt=formatted_prompt, should_stop=cancel.is_set if cancel else None, **self.cfg.prompt_configs
+            )
+        else:
+            llm_out = self.llm.create_completion(  # type: ignore
+                prompt=formatted_prompt,
+                stopping_criteria=StoppingCriteriaList([lambda _ids, _logits: cancel.is_set()]) if cancel else None,
+                **self.cfg.prompt_configs,
+            )
+        if cancel is not None and cancel.is_set():
+            raise GenerationCancelledError
+        self.throughput.record(
+            completion_tokens=llm_out.get("usage", {}).get("completion_tokens", 0),
+            seconds=time.perf_counter() - start,
+        )
+        return llm_out
+
+    def _init_completion_cache(self, model_path: Path) -> CompletionCache | None:
+        cache_cfg = self.cfg.cache
+        if not cache_cfg.enabled:
+            return None
+        if cache_cfg.deterministic_only and self.cfg.prompt_configs.get("temperature") != 0:
+            self.logger.warning("Completion cache disabled, prompt_configs temperature is not 0")
+            return None
+        try:
+            self.model_fingerprint = file_fingerprint(path=model_path)
+            return CompletionCache(path=MODEL_DIR_PATH / cache_cfg.path, max_bytes=cache_cfg.max_size_mb * 1024 * 1024)
+        except Exception as e:
+            self.logger.exception("Failed to initiate completion cache: %s", e)
+            return None
+
+    def _create_completion(self, formatted_prompt: str, cancel: threading.Event | None = None) -> dict:
+        if self.completion_cache is None:
+            return self._generate_completion(formatted_prompt=formatted_prompt, cancel=cancel)
+        key = completion_cache_key(
+            prompt=formatted_prompt, model_fingerprint=self.model_fingerprint, prompt_configs=self.cfg.prompt_configs
+        )
+        llm_out = self.completion_cache.get(key=key)
+        if llm_out is not None:
+            self.logger.debug("Completion cache hit %s", key)
+            return llm_out  # type: ignore
+        llm_out = self._generate_completion(formatted_prompt=formatted_prompt, cancel=cancel)
+        self.completion_cache.put(key=key, value=llm_out)
+        return llm_out
+
+    def warmup(self) -> None:
+        """Generate one token so the model weights are paged in before the first question"""
+        self.llm.create_completion(prompt=self.WARMUP_PROMPT, max_tokens=1)
 
     def run(self, prompt: Prompt, prompt_inputs: dict) -> str:
+        return self.generate(prompt=prompt, prompt_inputs=prompt_inputs).text
+
+    def generate(self, prompt: Prompt, prompt_inputs: dict, cancel: threading.Event | None = None) -> LLMOutput:
+        """Same as `run` but also return the token usage, setting `cancel` aborts the generation"""
         formatted_prompt = prompt.format_inputs(inputs=prompt_inputs)
         try:
             self.logger.debug("Running prompt '''%s'''", formatted_prompt)
-            llm_out = self.llm.create_completion(prompt=formatted_prompt, **self.cfg.prompt_configs)
+            llm_out = self._create_completion(formatted_prompt=formatted_prompt, cancel=cancel)
+        except GenerationCancelledError:
+            self.logger.info("Generation cancelled")
+            raise
         except Exception as e:
             self.logger.exception("Failed to get llm outputs with prompt '''%s''': %s", formatted_prompt, e)
             raise
         try:
             result = llm_out["choices"][0]["text"]
+            usage = llm_out.get("usage", {})
         except Exception as e:
             self.logger.exception("Failed to parse llm output %s: %s", llm_out, e)
             raise
         if prompt.output_key:
-            return _filter_text_after_key(text=result, key=prompt.output_key)
-        return result  # type: ignore
+            result = _filter_text_after_key(text=result, key=prompt.output_key)
+        return LLMOutput(
+            text=result,
+            prompt_tokens=usage.get("prompt_tokens", 0),
+            completion_tokens=usage.get("completion_tokens", 0),
+        )
+
+    def answer_question_based_on_sources(
+        self, question: str, sources: list[str], cancel: threading.Event | None = None
+    ) -> str:
+        return self.generate_answer(question=question, sources=sources, cancel=cancel).text
 
-    def answer_question_based_on_sources(self, question: str, sources: list[str]) -> str:
+    def generate_answer(self, question: str, sources: list[str], cancel: threading.Event | None = None) -> LLMOutput:
         context = "\n".join(f"- {src}" for src in sources)
-        answer = self.run(
+        out = self.generate(
             prompt=self.qa_prompt,
             prompt_inputs={QAPrompt.INPUT_CONTEXT_KEY: context, QAPrompt.INPUT_QUESTION_KEY: question},
+            cancel=cancel,
         )
-        answer = _filter_text_after_key(text=answer, key="Answer:")
+        answer = _filter_text_after_key(text=out.text, key="Answer:")
         answer = _filter_text_after_key(text=answer, key="A:")
         self.logger.debug("Got answer %s", answer)
-        return answer
+        return out.model_copy(update={"text": answer})
 
 
 def _filter_text_after_key(text: str, key: str) -> str:
@@ -0,0 +1,292 @@
+import json
+import time
+from collections.abc import Iterable, Sequence
+from pathlib import Path
+from typing import Literal
+
+import numpy as np
+from pydantic import BaseModel
+
+from .logging import get_logger
+
+QuantizationMode = Literal["int8", "binary"]
+
+_POPCOUNT = np.array([bin(byte).count("1") for byte in range(256)], dtype=np.uint8)
+_INT8_MAX = 127
+
+
+class QuantizedSearchStats(BaseModel):
+    searches: int = 0
+    first_pass_seconds: float = 0.0
+    rescore_seconds: float = 0.0
+    recall_samples: int = 0
+    recall_sum: float = 0.0
+
+    def summary(self) -> dict:
+        return {
+            "searches": self.searches,
+            "first_pass_latency_mean": self.first_pass_seconds / self.searches if self.searches else 0.0,
+            "rescore_latency_mean": self.rescore_seconds / self.searches if self.searches else 0.0,
+            "recall_samples": self.recall_samples,
+            "recall_mean": self.recall_sum / self.recall_samples if self.recall_samples else None,
+        }
+
+
+class QuantizedIndex:
+    """Embeddings of a collection stored as int8 or binary codes in memory and as float32 in a memory mapped file.
+
+    Search scans the codes block by block for the best `rescore_k` candidates, then re-scores them with the full
+    precision vectors, so the returned distances are exact squared L2 distances as chromadb returns. Rows are only
+    appended, deleted or replaced rows are masked until `compact`. Every `recall_sample_every` searches, the result is
+    compared with an exact search to report the recall.
+    """
+
+    VECTORS_FILE = "vectors.f32"
+    IDS_FILE = "ids.txt"
+    LIVE_FILE = "live.u8"
+    META_FILE = "meta.json"
+    BLOCK_ROWS = 16384
+
+    def __init__(self, dir_path: Path, mode: QuantizationMode, recall_sample_every: int = 0) -> None:
+        self.logger = get_logger(self.__class__.__name__)
+        self.dir_path = dir_path
+        self.mode = mode
+        self.recall_sample_every = recall_sample_every
+        self.stats = QuantizedSearchStats()
+        dir_path.mkdir(parents=True, exist_ok=True)
+        self._reset()
+        self._load()
+
+    def _reset(self) -> None:
+        self.dim: int | None = None
+        self.ids: list[str] = []
+        self.rows: dict[str, int] = {}  # row of the live ids
+        self._live = np.zeros(0, dtype=bool)
+        # code arrays grow by doubling their capacity, only the first `row_count` rows are used
+        self._codes = np.zeros((0, 0), dtype=np.uint8)
+        self._scales = np.zeros(0, dtype=np.float32)  # int8 dequantization scale
+        self._sq_norms = np.zeros(0, dtype=np.float32)  # squared norm of the dequantized int8 vectors
+        self._vectors: np.memmap | None = None
+
+    @property
+    def row_count(self) -> int:
+        return len(self.ids)
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def _load(self) -> None:
+        meta_path = self.dir_path / self.META_FILE
+        if not meta_path.exists():
+            return
+        self._init_dim(dim=json.loads(meta_path.read_text())["dim"])
+        vectors_rows = (self.dir_path / self.VECTORS_FILE).stat().st_size // (4 * self.dim)  # type: ignore
+        ids = (self.dir_path / self.IDS_FILE).read_text().splitlines()
+        live = np.fromfile(self.dir_path / self.LIVE_FILE, dtype=np.uint8).astype(bool)
+        row_count = min(vectors_rows, len(ids), len(live))
+        if max(vectors_rows, len(ids), len(live)) > row_count:
+            self._truncate(row_count=row_count, ids=ids)
+        if not row_count:
+            return
+        self.ids = ids[:row_count]
+        self._live = live[:row_count]
+        self.rows = {c_id: row for row, c_id in enumerate(self.ids) if self._live[row]}
+        self._reserve(row_count=row_count)
+        vectors = self._vectors_map()
+        for start in range(0, row_count, self.BLOCK_ROWS):
+            self._set_codes(start=start, vectors=np.asarray(vectors[start : start + self.BLOCK_ROWS]))
+        self.logger.info("Loaded %s rows (%s live) from %s", row_count, len(self), self.dir_path)
+
+    def _truncate(self, row_count: int, ids: list[str]) -> None:
+        """Drop the rows of an add interrupted between the writes of the files"""
+        self.logger.warning("Drop partially written rows after row %s of %s", row_count, self.dir_path)
+        with (self.dir_path / self.VECTORS_FILE).open(mode="r+b") as f:
+            f.truncate(row_count * 4 * self.dim)  # type: ignore
+        (self.dir_path / self.IDS_FILE).write_text("".join(f"{c_id}\n" for c_id in ids[:row_count]))
+        with (self.dir_path / self.LIVE_FILE).open(mode="r+b") as f:
+            f.truncate(row_count)
+
+    def _init_dim(self, dim: int) -> None:
+        self.dim = dim
+        code_width = dim if self.mode == "int8" else (dim + 7) // 8
+        self._codes = np.zeros((0, code_width), dtype=np.int8 if self.mode == "int8" else np.uint8)
+
+    def _reserve(self, row_count: int) -> None:
+        capacity = len(self._scales)
+        if row_count <= capacity:
+            return
+        capacity = max(row_count, 2 * capacity)
+        self._codes = np.resize(self._codes, (capacity, self._codes.shape[1]))
+        self._scales = np.resize(self._scales, capacity)
+        self._sq_norms = np.resize(self._sq_norms, capacity)
+
+    def _vectors_map(self) -> np.memmap:
+        if self._vectors is None or len(self._vectors) != self.row_count:
+            self._vectors = np.memmap(
+                self.dir_path / self.VECTORS_FILE, dtype=np.float32, mode="r", shape=(self.row_count, self.dim or 0)
+            )
+        return self._vectors
+
+    def _set_codes(self, start: int, vectors: np.ndarray) -> None:
+        end = start + len(vectors)
+        if self.mode == "binary":
+            self._codes[start:end] = np.packbits(vectors > 0, axis=1)
+            return
+        scales = np.abs(vectors).max(axis=1).clip(min=1e-12) / _INT8_MAX
+        codes = np.rint(vectors / scales[:, None])
+        self._codes[start:end] = codes.astype(np.int8)
+        self._scales[start:end] = scales
+        self._sq_norms[start:end] = (codes**2).sum(axis=1) * scales**2
+
+    def add(self, ids: Sequence[str], vectors: Sequence[Sequence[float]] | np.ndarray) -> None:
+        """Append the vectors, previous rows of the same ids are masked"""
+        if not len(ids):
+            return
+        arr = np.ascontiguousarray(vectors, dtype=np.float32)
+        if self.dim is None:
+            self._init_dim(dim=arr.shape[1])
+            (self.dir_path / self.META_FILE).write_text(json.dumps({"dim": self.dim}))
+        if arr.shape[1] != self.dim:
+            raise ValueError(f"Embedding dimension {arr.shape[1]} does not match index dimension {self.dim}")
+        self._mask_rows(rows=[self.rows[c_id] for c_id in ids if c_id in self.rows])
+
+        with (self.dir_path / self.VECTORS_FILE).open(mode="ab") as f:
+            arr.tofile(f)
+        with (self.dir_path / self.IDS_FILE).open(mode="a") as f:
+            f.writelines(f"{c_id}\n" for c_id in ids)
+        with (self.dir_path / self.LIVE_FILE).open(mode="ab") as f:
+            f.write(b"\x01" * len(ids))
+
+        first_row = self.row_count
+        self._reserve(row_count=first_row + len(ids))
+        self._set_codes(start=first_row, vectors=arr)
+        self.ids.extend(ids)
+        self.rows.update((c_id, first_row + idx) for idx, c_id in enumerate(ids))
+        self._live = np.concatenate([self._live, np.ones(len(ids), dtype=bool)])
+
+    def _mask_rows(self, rows: Iterable[int]) -> None:
+        rows = sorted(rows)
+        if not rows:
+            return
+        with (self.dir_path / self.LIVE_FILE).open(mode="r+b") as f:
+            for row in rows:
+                f.seek(row)
+                f.write(b"\x00")
+        self._live[rows] = False
+
+    def delete(self, ids: Iterable[str]) -> int:
+        rows = [self.rows.pop(c_id) for c_id in ids if c_id in self.rows]
+        self._mask_rows(rows=rows)
+        return len(rows)
+
+    def get_vectors(self, ids: Sequence[str]) -> np.ndarray:
+        rows = [self.rows[c_id] for c_id in ids]
+        return np.asarray(self._vectors_map()[rows]) if rows else np.zeros((0, self.dim or 0), dtype=np.float32)
+
+    def _candidate_rows(self, allowed_ids: Iterable[str] | None) -> np.ndarray:
+        if allowed_ids is None:
+            return np.flatnonzero(self._live)
+        return np.array(sorted(self.rows[c_id] for c_id in allowed_ids if c_id in self.rows), dtype=np.int64)
+
+    def _first_pass_scores(self, query: np.ndarray, rows: np.ndarray) -> np.ndarray:
+        """Approximate distances, lower is closer"""
+        codes = self._codes[rows]
+        scores: np.ndarray
+        if self.mode == "binary":
+            scores = _POPCOUNT[codes ^ np.packbits(query > 0)].sum(axis=1, dtype=np.int32).astype(np.float32)
+        else:
+            dots = (codes.astype(np.float32) @ query) * self._scales[rows]
+            scores = self._sq_norms[rows] - 2 * dots
+        return scores
+
+    def _top_rows(self, scores: np.ndarray, rows: np.ndarray, k: int) -> tuple[np.ndarray, np.ndarray]:
+        if len(rows) > k:
+            top = np.argpartition(scores, k - 1)[:k]
+            return scores[top], rows[top]
+        return scores, rows
+
+    def search(
+        self, query: Sequence[float], k: int, rescore_k: int, allowed_ids: Iterable[str] | None = None
+    ) -> list[tuple[str, float]]:
+        """Return the `k` closest (id, squared L2 distance), re-scored from the `rescore_k` best first pass rows"""
+        query_arr = np.asarray(query, dtype=np.float32)
+        rows = self._candidate_rows(allowed_ids=allowed_ids)
+        if not len(rows):
+            return []
+        rescore_k = max(rescore_k, k)
+
+        start = time.perf_counter()
+        best_scores, best_rows = np.zeros(0, dtype=np.float32), np.zeros(0, dtype=np.int64)
+        for block_start in range(0, len(rows), self.BLOCK_ROWS):
+            block_rows = rows[block_start : block_start + self.BLOCK_ROWS]
+            scores = self._first_pass_scores(query=query_arr, rows=block_rows)
+            best_scores, best_rows = self._top_rows(
+                scores=np.concatenate([best_scores, scores]), rows=np.concatenate([best_rows, block_rows]), k=rescore_k
+            )
+        first_pass_end = time.perf_counter()
+
+        hits = self._rescore(query=query_arr, rows=np.sort(best_rows), k=k)
+        self.stats.searches += 1
+        self.stats.first_pass_seconds += first_pass_end - start
+        self.stats.rescore_seconds += time.perf_counter() - first_pass_end
+        if self.recall_sample_every and self.stats.searches % self.recall_sample_every == 0:
+            self.measure_recall(query=query_arr, hits=hits, k=k, rows=rows)
+        return hits
+
+    def _rescore(self, query: np.ndarray, rows: np.ndarray, k: int) -> list[tuple[str, float]]:
+        vectors = np.asarray(self._vectors_map()[rows])  # sorted rows, sequential reads of the mapped file
+        distances = ((vectors - query) ** 2).sum(axis=1)
+        order = np.argsort(distances, kind="stable")[:k]
+        return [(self.ids[rows[idx]], float(distances[idx])) for idx in order]
+
+    def exact_search(
+        self, query: Sequence[float] | np.ndarray, k: int, rows: np.ndarray | None = None
+    ) -> list[tuple[str, float]]:
+        """Scan all the full precision vectors, only used to measure the recall"""
+        query_arr = np.asarray(query, dtype=np.float32)
+        rows = self._candidate_rows(allowed_ids=None) if rows is None else rows
+        best: list[tuple[str, float]] = []
+        for block_start in range(0, len(rows), self.BLOCK_ROWS):
+            best = sorted(
+                best + self._rescore(query=query_arr, rows=rows[block_start : block_start + self.BLOCK_ROWS], k=k),
+                key=lambda hit: hit[1],
+            )[:k]
+        return best
+
+    def measure_recall(
+        self, query: np.ndarray, hits: list[tuple[str, float]], k: int, rows: np.ndarray | None = None
+    ) -> float:
+        expected = {c_id for c_id, _ in self.exact_search(query=query, k=k, rows=rows)}
+        recall = len(expected & {c_id for c_id, _ in hits[:k]}) / len(expected) if expected else 1.0
+        self.stats.recall_samples += 1
+        self.stats.recall_sum += recall
+        self.logger.debug("Quantized search recall@%s: %.2f", k, recall)
+        return recall
+
+    def compact(self) -> None:
+        """Rewrite the files with the live rows only"""
+        if len(self.rows) == self.row_count:
+            return
+        live_rows = np.flatnonzero(self._live)
+        vectors = self._vectors_map()
+        with (self.dir_path / f"{self.VECTORS_FILE}.tmp").open(mode="wb") as f:
+            for start in range(0, len(live_rows), self.BLOCK_ROWS):
+                np.asarray(vectors[live_rows[start : start + self.BLOCK_ROWS]]).tofile(f)
+        (self.dir_path / f"{self.IDS_FILE}.tmp").write_text("".join(f"{self.ids[row]}\n" for row in live_rows))
+        (self.dir_path / f"{self.LIVE_FILE}.tmp").write_bytes(b"\x01" * len(live_rows))
+        self._vectors = None
+        for file_name in (self.VECTORS_FILE, self.IDS_FILE, self.LIVE_FILE):
+            (self.dir_path / f"{file_name}.tmp").replace(self.dir_path / file_name)
+
+        dropped = self.row_count - len(live_rows)
+        self._reset()
+        self._load()
+        self.logger.info("Compacted %s, dropped %s rows", self.dir_path, dropped)
+
+    def memory_report(self) -> dict:
+        return {
+            "rows": self.row_count,
+            "live_rows": len(self),
+            "code_bytes": int(self._codes.nbytes + self._scales.nbytes + self._sq_norms.nbytes),
+            "full_precision_bytes": self.row_count * (self.dim or 0) * 4,
+        }
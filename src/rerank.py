@@ -0,0 +1,73 @@
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from collections.abc import Sequence
+
+from .logging import get_logger
+
+
+class Reranker(ABC):
+    """Select the best `top_k` of the over-fetched candidates, results are cached per query and candidates.
+
+    Candidates are identified by their id and content hash, so a chunk rewritten under the same id is reranked again.
+    """
+
+    def __init__(self, cache_size: int = 1024) -> None:
+        self.logger = get_logger(self.__class__.__name__)
+        self.cache_size = cache_size
+        self._cache: OrderedDict[tuple, list[int]] = OrderedDict()
+
+    @abstractmethod
+    def _rank(self, distances: Sequence[float], embeddings: Sequence[Sequence[float]], top_k: int) -> list[int]:
+        pass
+
+    def rerank(  # noqa: PLR0913
+        self,
+        query: str,
+        ids: Sequence[str],
+        content_hashes: Sequence[str | None],
+        distances: Sequence[float],
+        embeddings: Sequence[Sequence[float]],
+        top_k: int,
+    ) -> list[int]:
+        """Return the indices of the selected candidates, best first"""
+        if len(ids) <= 1:
+            return list(range(len(ids)))
+        key = (query, tuple(zip(ids, content_hashes, strict=True)), top_k)
+        if key in self._cache:
+            self._cache.move_to_end(key)
+            return self._cache[key]
+        ranked = self._rank(distances=distances, embeddings=embeddings, top_k=top_k)
+        self._cache[key] = ranked
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return ranked
+
+
+class MMRReranker(Reranker):
+    """Maximal Marginal Relevance: trade off the relevance to the query against the similarity to selected chunks"""
+
+    def __init__(self, mmr_lambda: float = 0.7, cache_size: int = 1024) -> None:
+        super().__init__(cache_size=cache_size)
+        self.mmr_lambda = mmr_lambda
+
+    def _rank(self, distances: Sequence[float], embeddings: Sequence[Sequence[float]], top_k: int) -> list[int]:
+        import numpy as np
+
+        # chroma default l2 space returns squared distances, for normalized vectors cos_sim = 1 - d / 2
+        relevance = 1 - np.asarray(distances, dtype=np.float32) / 2
+        vectors = np.asarray(embeddings, dtype=np.float32)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True).clip(min=1e-12)
+        similarity = vectors @ vectors.T  # all pairs scored in one batch
+
+        selected = [int(np.argmax(relevance))]
+        max_sim_to_selected = similarity[selected[0]].copy()
+        candidates = np.ones(len(relevance), dtype=bool)
+        candidates[selected[0]] = False
+        while len(selected) < min(top_k, len(relevance)):
+            scores = self.mmr_lambda * relevance - (1 - self.mmr_lambda) * max_sim_to_selected
+            scores[~candidates] = -np.inf
+            best = int(np.argmax(scores))
+            selected.append(best)
+            candidates[best] = False
+            max_sim_to_selected = np.maximum(max_sim_to_selected, similarity[best])
+        return selected
@@ -0,0 +1,132 @@
+import asyncio
+from collections import defaultdict, deque
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
+
+from .config import CONFIGS
+from .logging import get_logger
+from .singleton import ThreadUnsafeSingletonMeta
+
+
+class SchedulerError(Exception):
+    pass
+
+
+class TenantQueueFullError(SchedulerError):
+    def __init__(self, tenant: str):
+        super().__init__(f"Too many pending requests for Tenant({tenant})")
+
+
+class OverloadedError(SchedulerError):
+    def __init__(self, estimated_wait: float, remaining_seconds: float):
+        super().__init__(
+            f"Estimated wait of {estimated_wait:.1f}s exceeds request deadline in {remaining_seconds:.1f}s"
+        )
+        self.estimated_wait = estimated_wait
+
+
+class DeadlineExceededError(SchedulerError):
+    def __init__(self) -> None:
+        super().__init__("Request deadline exceeded while waiting for the LLM")
+
+
+class FairScheduler(metaclass=ThreadUnsafeSingletonMeta):
+    """Share the LLM slots between tenants in round-robin order.
+
+    Each tenant runs at most `max_concurrent_requests` at once and can have at most `max_pending_requests` waiting,
+    so a single heavy tenant cannot starve the others. Requests with a deadline are rejected upfront if the queue ahead
+    of them cannot be served in time, and dropped from the queue once their deadline passes.
+    """
+
+    def __init__(self) -> None:
+        self.logger = get_logger(self.__class__.__name__)
+        self.cfg = CONFIGS.tenancy
+        self._free_slots = self.cfg.llm_slots
+        self._tenant_running: dict[str, int] = defaultdict(int)
+        self._tenant_queues: dict[str, deque[asyncio.Future]] = defaultdict(deque)
+        self._round_robin: deque[str] = deque()
+        self.overloaded_count = 0
+        self.deadline_exceeded_count = 0
+
+    def pending_count(self, tenant: str) -> int:
+        return len(self._tenant_queues[tenant])
+
+    @property
+    def queued_count(self) -> int:
+        """Running and pending requests of all tenants"""
+        running = self.cfg.llm_slots - self._free_slots
+        return running + sum(not waiter.done() for queue in self._tenant_queues.values() for waiter in queue)
+
+    def estimate_wait(self, request_seconds: float) -> float:
+        """Seconds until a new request gets a slot, if every request keeps its slot `request_seconds`"""
+        return self.queued_count / self.cfg.llm_slots * request_seconds
+
+    def _admit(self, deadline: float, request_seconds: float | None) -> None:
+        remaining = deadline - asyncio.get_running_loop().time()
+        estimated_wait = self.estimate_wait(request_seconds=request_seconds) if request_seconds else 0.0
+        if remaining <= 0 or estimated_wait > remaining:
+            self.overloaded_count += 1
+            self.logger.warning("Rejected request: %s queued, estimated wait %.1fs", self.queued_count, estimated_wait)
+            raise OverloadedError(estimated_wait=estimated_wait, remaining_seconds=remaining)
+
+    def _dispatch(self) -> None:
+        granted = True
+        while self._free_slots and granted:
+            granted = False
+            for _ in range(len(self._round_robin)):
+                if not self._free_slots:
+                    return
+                tenant = self._round_robin[0]
+                self._round_robin.rotate(-1)
+                queue = self._tenant_queues[tenant]
+                while queue and queue[0].done():  # cancelled while waiting
+                    queue.popleft()
+                if not queue:
+                    self._round_robin.remove(tenant)
+                    continue
+                if self._tenant_running[tenant] >= self.cfg.max_concurrent_requests:
+                    continue
+                self._free_slots -= 1
+                self._tenant_running[tenant] += 1
+                queue.popleft().set_result(None)
+                granted = True
+
+    @asynccontextmanager
+    async def slot(
+        self, tenant: str, deadline: float | None = None, request_seconds: float | None = None
+    ) -> AsyncIterator[None]:
+        """Wait for an LLM slot.
+
+        `deadline` is in event loop time, `request_seconds` the expected time a request keeps a slot (unknown before the
+        first generation).
+        """
+        queue = self._tenant_queues[tenant]
+        if len(queue) >= self.cfg.max_pending_requests:
+            raise TenantQueueFullError(tenant=tenant)
+        if deadline is not None:
+            self._admit(deadline=deadline, request_seconds=request_seconds)
+        loop = asyncio.get_running_loop()
+        waiter = loop.create_future()
+        queue.append(waiter)
+        if tenant not in self._round_robin:
+            self._round_robin.appendleft(tenant)  # tenant was idle, serve it before the ones already being served
+        self._dispatch()
+        try:
+            await asyncio.wait_for(waiter, timeout=deadline - loop.time() if deadline is not None else None)
+        # asyncio.TimeoutError is the builtin TimeoutError only since python 3.11
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:  # noqa: UP041
+            if waiter.done() and not waiter.cancelled():  # slot was granted right before cancellation
+                self._release(tenant=tenant)
+            if isinstance(e, asyncio.TimeoutError):  # noqa: UP041
+                self.deadline_exceeded_count += 1
+                raise DeadlineExceededError from e
+            raise
+        try:
+            yield
+        finally:
+            self._release(tenant=tenant)
+
+    def _release(self, tenant: str) -> None:
+        self._free_slots += 1
+        self._tenant_running[tenant] -= 1
+        self._dispatch()
@@ -0,0 +1,200 @@
+import time
+from abc import ABC, abstractmethod
+from collections.abc import Callable, Sequence
+from typing import TYPE_CHECKING, Any
+
+from pydantic import BaseModel, ConfigDict
+
+from .logging import get_logger
+
+if TYPE_CHECKING:
+    from llama_cpp import Llama
+
+
+class Drafter(ABC):
+    @abstractmethod
+    def draft(self, tokens: Sequence[int], num_tokens: int) -> list[int]:
+        """Propose up to `num_tokens` tokens following `tokens`"""
+
+
+class PromptLookupDrafter(Drafter):
+    """Propose the tokens that followed the latest earlier occurrence of the trailing n-gram.
+
+    Answers copied from the retrieved context are drafted from the prompt itself, without a draft model.
+    """
+
+    def __init__(self, max_ngram_size: int = 3, min_ngram_size: int = 1) -> None:
+        self.max_ngram_size = max_ngram_size
+        self.min_ngram_size = min_ngram_size
+
+    def draft(self, tokens: Sequence[int], num_tokens: int) -> list[int]:
+        tokens = list(tokens)
+        for ngram_size in range(min(self.max_ngram_size, len(tokens) - 1), self.min_ngram_size - 1, -1):
+            ngram = tokens[-ngram_size:]
+            for start in range(len(tokens) - ngram_size - 1, -1, -1):
+                if tokens[start : start + ngram_size] == ngram:
+                    return tokens[start + ngram_size : start + ngram_size + num_tokens]
+        return []
+
+
+class LlamaDrafter(Drafter):
+    """Greedy drafts from a small model sharing the vocabulary of the main model"""
+
+    def __init__(self, llm: "Llama") -> None:
+        self.llm = llm
+
+    def draft(self, tokens: Sequence[int], num_tokens: int) -> list[int]:
+        import numpy as np
+
+        num_tokens = min(num_tokens, self.llm.n_ctx() - len(tokens))
+        if num_tokens <= 0:
+            return []
+        # reuse the evaluated prefix kept from the previous draft
+        prefix = 0
+        for evaluated, token in zip(self.llm.input_ids[: self.llm.n_tokens], tokens, strict=False):
+            if evaluated != token:
+                break
+            prefix += 1
+        self.llm.n_tokens = min(prefix, len(tokens) - 1)
+        self.llm.eval(tokens[self.llm.n_tokens :])
+
+        drafts: list[int] = []
+        for _ in range(num_tokens):
+            token = int(np.argmax(self.llm.scores[self.llm.n_tokens - 1]))
+            if token == self.llm.token_eos():
+                break
+            drafts.append(token)
+            self.llm.eval([token])
+        return drafts
+
+
+class SamplingConfigs(BaseModel):
+    """Subset of `Llama.create_completion` arguments supported by the speculative decoder"""
+
+    model_config = ConfigDict(extra="allow")
+
+    max_tokens: int = 16
+    temperature: float = 0.8
+    top_k: int = 40
+    top_p: float = 0.95
+    min_p: float = 0.05
+    repeat_penalty: float = 1.1
+    stop: str | list[str] | None = None
+
+
+class SpeculativeDecoder:
+    """Generate with `llm` verifying the drafted tokens of all positions in one batch evaluation.
+
+    At every position the token is sampled from the main model as in normal decoding and the drafted token is only
+    accepted if they are equal, so the output follows the main model distribution. `llm` requires `logits_all=True`.
+    """
+
+    def __init__(self, llm: "Llama", drafter: Drafter, num_draft_tokens: int) -> None:
+        self.logger = get_logger(self.__class__.__name__)
+        self.llm = llm
+        self.drafter = drafter
+        self.num_draft_tokens = num_draft_tokens
+        self.drafted_count = 0
+        self.accepted_count = 0
+
+    @property
+    def acceptance_rate(self) -> float:
+        return self.accepted_count / self.drafted_count if self.drafted_count else 0.0
+
+    def _sample_and_verify(self, n_past: int, drafts: list[int], cfg: SamplingConfigs) -> list[int]:
+        """Return the accepted drafts followed by the token sampled after them"""
+        new_tokens = []
+        for idx in range(len(drafts) + 1):
+            self.llm.n_tokens = n_past + idx  # sample with the logits and penalties of this position
+            token = self.llm.sample(
+                top_k=cfg.top_k,
+                top_p=cfg.top_p,
+                min_p=cfg.min_p,
+                temp=cfg.temperature,
+                repeat_penalty=cfg.repeat_penalty,
+            )
+            new_tokens.append(token)
+            if idx == len(drafts) or token != drafts[idx] or token == self.llm.token_eos():
+                break
+        return new_tokens
+
+    def _find_stop(self, tokens: list[int], stops: list[str]) -> str | None:
+        text = self.llm.detokenize(tokens).decode(errors="ignore")
+        stop_idx = min((idx for idx in (text.find(s) for s in stops) if idx >= 0), default=-1)
+        return text[:stop_idx] if stop_idx >= 0 else None
+
+    def create_completion(
+        self, prompt: str, should_stop: Callable[[], bool] | None = None, **prompt_configs: Any
+    ) -> dict:
+        """Same output format as `Llama.create_completion`, with the drafting stats in `speculative`.
+
+        `should_stop` is checked before every decoding step to abort the generation early.
+        """
+        cfg = SamplingConfigs.model_validate(prompt_configs)
+        if cfg.model_extra:
+            self.logger.warning("Unsupported speculative decoding configs ignored: %s", list(cfg.model_extra))
+        stops = [cfg.stop] if isinstance(cfg.stop, str) else cfg.stop or []
+        start_time = time.perf_counter()
+
+        prompt_tokens = self.llm.tokenize(prompt.encode())
+        n_ctx = self.llm.n_ctx()
+        if len(prompt_tokens) >= n_ctx:
+            raise ValueError(f"Requested tokens ({len(prompt_tokens)}) exceed context window of {n_ctx}")
+        self.llm.reset()
+        self.llm.eval(prompt_tokens)
+        n_past = self.llm.n_tokens
+        eos = self.llm.token_eos()
+        generated: list[int] = []
+        drafted = accepted = 0
+        finish_reason = "length"
+        text = None
+
+        while len(generated) < cfg.max_tokens and n_past < n_ctx:
+            if should_stop is not None and should_stop():
+                finish_reason = "stop"
+                break
+            max_drafts = max(min(self.num_draft_tokens, cfg.max_tokens - len(generated) - 1, n_ctx - n_past - 1), 0)
+            drafts = self.drafter.draft(tokens=prompt_tokens + generated, num_tokens=max_drafts) if max_drafts else []
+            drafts = drafts[:max_drafts]
+            if drafts:
+                self.llm.eval(drafts)
+            new_tokens = self._sample_and_verify(n_past=n_past, drafts=drafts, cfg=cfg)
+            drafted += len(drafts)
+            accepted += len(new_tokens) - 1
+
+            if eos in new_tokens:
+                generated += new_tokens[: new_tokens.index(eos)]
+                finish_reason = "stop"
+                break
+            generated += new_tokens
+            if stops and (text := self._find_stop(tokens=generated, stops=stops)) is not None:
+                finish_reason = "stop"
+                break
+            if len(generated) >= cfg.max_tokens:
+                break
+            # drafts after the first rejected one are dropped from the KV cache by the next eval
+            self.llm.n_tokens = n_past + len(new_tokens) - 1
+            self.llm.eval(new_tokens[-1:])
+            n_past = self.llm.n_tokens
+
+        if text is None:
+            text = self.llm.detokenize(generated).decode(errors="ignore")
+        self.drafted_count += drafted
+        self.accepted_count += accepted
+        self.logger.info(
+            "Generated %s tokens in %.2fs, accepted %s/%s drafted tokens (total acceptance rate %.2f)",
+            len(generated),
+            time.perf_counter() - start_time,
+            accepted,
+            drafted,
+            self.acceptance_rate,
+        )
+        return {
+            "choices": [{"text": text, "index": 0, "finish_reason": finish_reason}],
+            "usage": {
+                "prompt_tokens": len(prompt_tokens),
+                "completion_tokens": len(generated),
+                "total_tokens": len(prompt_tokens) + len(generated),
+            },
+            "speculative": {"drafted_tokens": drafted, "accepted_tokens": accepted},
+        }
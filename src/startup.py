@@ -0,0 +1,91 @@
+import threading
+import time
+from collections.abc import Callable
+from typing import Any, Literal, TypeVar
+
+from .config import CONFIGS
+from .logging import get_logger
+from .singleton import ThreadUnsafeSingletonMeta
+
+PreloadStatus = Literal["LOADING", "READY", "FAILED"]
+T = TypeVar("T")
+
+
+class Preloader(metaclass=ThreadUnsafeSingletonMeta):
+    """Load the heavy subsystems (vector store, text splitter, LLM) in a background thread.
+
+    The server accepts connections while loading, `wait` blocks the requests needing a subsystem until it is loaded.
+    The failed subsystems are retried in background with an exponential backoff, the preloader is ready again once
+    they are loaded. Without preloading the subsystems are loaded lazily by the first request and the preloader is
+    always ready.
+    """
+
+    def __init__(self) -> None:
+        self.logger = get_logger(self.__class__.__name__)
+        self.cfg = CONFIGS.startup
+        self.load_times: dict[str, float] = {}
+        self.errors: dict[str, str] = {}
+        self._thread: threading.Thread | None = None
+        self._done = threading.Event()
+        # the singletons are not thread safe, a retry and a lazy load must not create one at the same time
+        self._load_lock = threading.RLock()
+
+    @property
+    def error(self) -> str | None:
+        return "; ".join(self.errors.values()) or None
+
+    @property
+    def status(self) -> PreloadStatus:
+        if self._thread is None:
+            return "READY"
+        if not self._done.is_set():
+            return "LOADING"
+        return "FAILED" if self.errors else "READY"
+
+    def start(self, loaders: dict[str, Callable[[], Any]]) -> None:
+        """Run the loaders in order in a background thread, only the first call has an effect"""
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._load, kwargs={"loaders": loaders}, daemon=True)
+        self._thread.start()
+
+    def _load(self, loaders: dict[str, Callable[[], Any]]) -> None:
+        pending = dict(loaders)
+        retry_interval = self.cfg.retry_interval
+        try:
+            while True:
+                pending = {name: loader for name, loader in pending.items() if not self._load_one(name, loader)}
+                self._done.set()
+                if not pending or not retry_interval:
+                    return
+                self.logger.info("Retry to preload %s in %.2fs", list(pending), retry_interval)
+                time.sleep(retry_interval)
+                retry_interval = min(retry_interval * 2, self.cfg.max_retry_interval)
+        finally:
+            self._done.set()
+
+    def _load_one(self, name: str, loader: Callable[[], Any]) -> bool:
+        start = time.perf_counter()
+        try:
+            with self._load_lock:
+                loader()
+        except Exception as e:
+            self.logger.exception("Failed to preload %s: %s", name, e)
+            self.errors[name] = f"Failed to preload {name}: {e}"
+            return False
+        self.errors.pop(name, None)
+        self.load_times[name] = time.perf_counter() - start
+        self.logger.info("Preloaded %s in %.2fs", name, self.load_times[name])
+        return True
+
+    def wait(self, timeout: float | None = None) -> bool:
+        """Block until preloading is done, return `False` on timeout"""
+        if self._thread is None:
+            return True
+        return self._done.wait(timeout=timeout)
+
+    def load(self, loader: Callable[[], T]) -> T:
+        """Wait for preloading then get a subsystem, loading it lazily if it failed to preload"""
+        self.wait()
+        with self._load_lock:
+            return loader()
@@ -1,13 +1,34 @@
-from collections.abc import Iterable
-from typing import Any
+import functools
+import hashlib
+import heapq
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from collections.abc import Callable, Iterable
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import suppress
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Concatenate, ParamSpec, TypeVar
+from uuid import uuid4
 
-from chromadb import Collection, EphemeralClient, HttpClient, Settings
+from pydantic import BaseModel
 
-from .config import CONFIGS
-from .docs import DocumentChunk, DocumentChunkMetadata
+from .config import CONFIGS, MODEL_DIR_PATH
+from .docs import ChunkBatch, DocumentChunk, DocumentChunkMetadata
 from .logging import get_logger
+from .rerank import MMRReranker, Reranker
 from .singleton import ThreadUnsafeSingletonMeta
 
+if TYPE_CHECKING:
+    from chromadb import Collection, EmbeddingFunction, GetResult
+    from chromadb.api import ClientAPI
+
+    from .quantization import QuantizedIndex
+
+T = TypeVar("T")
+P = ParamSpec("P")
+
 
 class VectorStoreError(Exception):
     pass
@@ -18,52 +39,671 @@ class CollectionNotFoundError(VectorStoreError):
         super().__init__(f"Collection({collection_name}) not found")
 
 
+class DocumentNotFoundError(VectorStoreError):
+    def __init__(self, document_id: str):
+        super().__init__(f"Document({document_id}) not found")
+
+
+class QuotaExceededError(VectorStoreError):
+    def __init__(self, collection_name: str, max_chunks: int):
+        super().__init__(f"Collection({collection_name}) exceeds quota of {max_chunks} chunks")
+
+
+class TenantLimitError(VectorStoreError):
+    def __init__(self, max_tenants: int):
+        super().__init__(f"Cannot create a new tenant collection, limit of {max_tenants} tenants reached")
+
+
+class DocumentUpdateResult(BaseModel):
+    added: int = 0
+    updated: int = 0
+    unchanged: int = 0
+    deleted: int = 0
+    embedded: int = 0  # number of added/updated chunks whose content was not already embedded
+
+
+class RetrievedChunks:
+    """Columnar search results, converted to `DocumentChunk` only when returned to API users"""
+
+    __slots__ = ("ids", "texts", "metadatas", "distances")
+
+    def __init__(self, ids: list[str], texts: list[str], metadatas: list[dict], distances: list[float]) -> None:
+        self.ids = ids
+        self.texts = texts
+        self.metadatas = metadatas
+        self.distances = distances
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def to_document_chunks(self) -> list[DocumentChunk]:
+        return [
+            DocumentChunk(id=c_id, text=text, metadata=DocumentChunkMetadata(**meta))
+            for c_id, text, meta in zip(self.ids, self.texts, self.metadatas, strict=True)
+        ]
+
+
+def _content_hash(text: str) -> str:
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+def _batched(items: list, batch_size: int) -> Iterable[list]:
+    for start in range(0, len(items), batch_size):
+        yield items[start : start + batch_size]
+
+
+def _merge_query_results(results: list[dict], n_results: int) -> dict:
+    """Merge the single query results of several shards into the `n_results` closest, same format as one result"""
+    fields = [f for f in ("ids", "distances", "documents", "metadatas", "embeddings") if results[0].get(f) is not None]
+    rows = [(res, idx) for res in results for idx in range(len(res["ids"][0]))]
+    rows = heapq.nsmallest(n_results, rows, key=lambda row: row[0]["distances"][0][row[1]])
+    return {field: [[res[field][0][idx] for res, idx in rows]] for field in fields}
+
+
+def _locked(method: Callable[Concatenate["VectorStore", P], T]) -> Callable[Concatenate["VectorStore", P], T]:
+    """Hold the store lock during the call, so a compaction cannot swap the collection in the middle of it"""
+
+    @functools.wraps(method)
+    def wrapper(self: "VectorStore", *args: P.args, **kwargs: P.kwargs) -> T:
+        with self._lock:
+            return method(self, *args, **kwargs)
+
+    return wrapper
+
+
 class VectorStore(metaclass=ThreadUnsafeSingletonMeta):
     DEFAULT_COLLECTION_NAME = "default"
+    CONTENT_HASH_KEY = "content_hash"
+    # temporary collections of a compaction: the rebuilt one, then the replaced one until it is deleted
+    COMPACTING_SUFFIX = "__compacting"
+    REPLACED_SUFFIX = "__replaced"
+    # collection metadata leasing it to a compaction, shared by all processes using the same chroma
+    LEASE_OWNER_KEY = "compaction_lease_owner"
+    LEASE_PHASE_KEY = "compaction_lease_phase"  # "copy", or "swap" during which the other processes do not write
+    LEASE_UNTIL_KEY = "compaction_lease_until"  # unix time, 0 once released
+    LEASE_POLL_INTERVAL = 0.05
 
     def __init__(self, chromadb_in_memory: bool = False) -> None:
         self.logger = get_logger(name=self.__class__.__name__)
+        self.clients = self._create_clients(chromadb_in_memory=chromadb_in_memory)
+        self.chromadb_client = self.clients[0]
+        self._executor = (
+            ThreadPoolExecutor(max_workers=len(self.clients), thread_name_prefix="shard")
+            if len(self.clients) > 1
+            else None
+        )
+        self.distance_score_threshold = CONFIGS.chromadb.distance_score_threshold
+        self.batch_size = CONFIGS.chromadb.batch_size
+        self.compaction_deleted_ratio = CONFIGS.chromadb.compaction_deleted_ratio
+        self.compaction_lease_seconds = CONFIGS.chromadb.compaction_lease_seconds
+        self.max_chunks = CONFIGS.tenancy.max_chunks
+        self.max_tenants = CONFIGS.tenancy.max_tenants
+        self._known_collections: set[str] = set()
+        self.retrieval_cfg = CONFIGS.retrieval
+        self.reranker: Reranker | None = None
+        if self.retrieval_cfg.rerank == "mmr":
+            self.reranker = MMRReranker(
+                mmr_lambda=self.retrieval_cfg.mmr_lambda, cache_size=self.retrieval_cfg.rerank_cache_size
+            )
+        self._deleted_counts: dict[tuple[int, str], int] = defaultdict(int)
+        self._lock = threading.RLock()
+        self._compaction_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="compaction")
+        self._compactions: dict[tuple[int, str], Future] = {}
+        self._lease_owner = uuid4().hex
+        self._init_quantization(chromadb_in_memory=chromadb_in_memory)
+        self.default_collection = self.get_or_create_collection(name=self.DEFAULT_COLLECTION_NAME)
+
+    @staticmethod
+    def _create_clients(chromadb_in_memory: bool) -> list["ClientAPI"]:
+        """One client per shard, in memory shards are separate databases of the single ephemeral chroma system"""
+        from chromadb import AdminClient, EphemeralClient, HttpClient, Settings  # slow import, only when needed
+
+        cfg = CONFIGS.chromadb
         chromadb_client_settings = Settings(anonymized_telemetry=False)
+        shard_configs = cfg.shards or [cfg.client_configs]
+        if not chromadb_in_memory:
+            return [
+                HttpClient(database=cfg.database, settings=chromadb_client_settings, **client_configs)
+                for client_configs in shard_configs
+            ]
+        clients = []
+        for shard in range(len(shard_configs)):
+            database = f"{cfg.database}_shard{shard}" if shard else cfg.database
+            if shard:
+                admin_client = AdminClient(settings=chromadb_client_settings)
+                try:
+                    admin_client.get_database(name=database)
+                except Exception:
+                    admin_client.create_database(name=database)
+            clients.append(EphemeralClient(database=database, settings=chromadb_client_settings))
+        return clients
+
+    @property
+    def shard_count(self) -> int:
+        return len(self.clients)
+
+    def shard_of(self, document_id: str) -> int:
+        """Shard owning all chunks of the document, stable across processes"""
+        if self.shard_count == 1:
+            return 0
+        return int.from_bytes(hashlib.sha256(document_id.encode()).digest()[:8], "big") % self.shard_count
+
+    def _map_shards(self, func: Callable[[int], T], shards: Iterable[int] | None = None) -> list[T]:
+        """Call `func` with every shard (or the given ones), in parallel if there are several"""
+        shards = list(range(self.shard_count)) if shards is None else list(shards)
+        if self._executor is None or len(shards) == 1:
+            return [func(shard) for shard in shards]
+        return list(self._executor.map(func, shards))
+
+    def heartbeat(self) -> None:
+        """Raise if any shard is unreachable"""
+        self._map_shards(lambda shard: self.clients[shard].heartbeat())
+
+    def _init_quantization(self, chromadb_in_memory: bool) -> None:
+        cfg = CONFIGS.chromadb
+        self.quantization = cfg.quantization
+        self.rescore_factor = cfg.rescore_factor
+        self._quantized_indexes: dict[str, QuantizedIndex] = {}
+        self._embedding_function: EmbeddingFunction | None = None
+        if self.quantization == "none":
+            return
+        from chromadb.utils.embedding_functions import DefaultEmbeddingFunction
+
+        # same embedding model as the collections, which embed themselves when quantization is disabled
+        self._embedding_function = DefaultEmbeddingFunction()
         if chromadb_in_memory:
-            self.chromadb_client = EphemeralClient(
-                database=CONFIGS.chromadb.database, settings=chromadb_client_settings
-            )
+            # removed with the store or at exit, the index is rebuilt from chroma
+            self._quantized_index_tmp_dir = tempfile.TemporaryDirectory(prefix="quantized_index_")
+            self._quantized_index_dir = Path(self._quantized_index_tmp_dir.name)
         else:
-            self.chromadb_client = HttpClient(
-                database=CONFIGS.chromadb.database, settings=chromadb_client_settings, **CONFIGS.chromadb.client_configs
+            self._quantized_index_dir = MODEL_DIR_PATH / cfg.quantized_index_dir / cfg.database
+
+    def _shard_key(self, collection_name: str, shard: int) -> str:
+        return f"shard{shard}/{collection_name}" if self.shard_count > 1 else collection_name
+
+    def _quantized_index(self, collection_name: str, shard: int = 0) -> "QuantizedIndex | None":
+        if self.quantization == "none":
+            return None
+        key = self._shard_key(collection_name=collection_name, shard=shard)
+        if key not in self._quantized_indexes:
+            from .quantization import QuantizedIndex
+
+            self._quantized_indexes[key] = QuantizedIndex(
+                dir_path=self._quantized_index_dir / key,
+                mode=self.quantization,
+                recall_sample_every=CONFIGS.chromadb.recall_sample_every,
             )
-        self.distance_score_threshold = CONFIGS.chromadb.distance_score_threshold
-        self.default_collection = self.chromadb_client.get_or_create_collection(name=self.DEFAULT_COLLECTION_NAME)
+        return self._quantized_indexes[key]
+
+    def _embed(self, texts: list[str]) -> list:
+        return self._embedding_function(texts)  # type: ignore
 
-    def get_collection(self, name: str) -> Collection:
+    def _write_chunks(  # noqa: PLR0913
+        self,
+        collection: "Collection",
+        ids: list[str],
+        metas: list[dict],
+        docs: list[str],
+        embeddings: list | None = None,
+        upsert: bool = False,
+        shard: int = 0,
+    ) -> None:
+        """Add or upsert chunks, with quantization their embeddings are also added to the side index"""
+        index = self._quantized_index(collection_name=collection.name, shard=shard)
+        if index is not None:
+            embeddings = embeddings if embeddings is not None else self._embed(texts=docs)
+            index.add(ids=ids, vectors=embeddings)
+
+        def _write(target: "Collection") -> None:
+            write = target.upsert if upsert else target.add
+            write(ids=ids, metadatas=metas, documents=docs, embeddings=embeddings)  # type: ignore
+
+        self._write_live(collection=collection, write=_write, shard=shard)
+
+    def _write_live(self, collection: "Collection", write: Callable[["Collection"], None], shard: int = 0) -> None:
+        """Apply the (idempotent) write, again on the rebuilt collection if a compaction swapped it meanwhile.
+
+        A compaction syncs the writes done before its swap phase, a write which may have missed them is repeated once
+        the swap is done.
+        """
         try:
-            return self.chromadb_client.get_collection(name=name)
+            write(collection)
+        except Exception:
+            if (live := self._live_after_swap(collection=collection, shard=shard)) is None:
+                raise
+            write(live)
+            return
+        if (live := self._live_after_swap(collection=collection, shard=shard)) is not None:
+            write(live)
+
+    def _live_after_swap(self, collection: "Collection", shard: int) -> "Collection | None":
+        """Wait for the swap of a compaction of another process, return the live collection if it may miss writes"""
+        client = self.clients[shard]
+        deadline = time.monotonic() + self.compaction_lease_seconds
+        swapped = False
+        while True:
+            try:
+                live = client.get_collection(name=collection.name)
+            except Exception:
+                # renamed in the middle of a swap, else the collection got deleted
+                replaced_name = f"{collection.name}{self.REPLACED_SUFFIX}"
+                if not any(col.name == replaced_name for col in client.list_collections()):
+                    return None
+                live = None
+            if live is not None and not self._is_swapping(metadata=live.metadata):
+                return live if swapped or live.id != collection.id else None
+            if time.monotonic() >= deadline:
+                raise VectorStoreError(f"Collection({collection.name}) is still being swapped by a compaction")
+            swapped = True
+            time.sleep(self.LEASE_POLL_INTERVAL)
+
+    def _get_embeddings(self, collection: "Collection", ids: list[str]) -> dict[str, list]:
+        res = collection.get(ids=ids, include=["embeddings"])
+        return dict(zip(res["ids"], res["embeddings"], strict=True))  # type: ignore
+
+    def quantization_report(self) -> dict | None:
+        if self.quantization == "none":
+            return None
+        return {
+            "mode": self.quantization,
+            "collections": {
+                name: {**index.memory_report(), **index.stats.summary()}
+                for name, index in self._quantized_indexes.items()
+            },
+        }
+
+    def get_collection(self, name: str, shard: int = 0) -> "Collection":
+        try:
+            return self.clients[shard].get_collection(name=name)
         except Exception as e:
             self.logger.exception("Failed to retrieve collection %s: %s", name, e)
             raise CollectionNotFoundError(collection_name=name) from e
 
+    @_locked
+    def get_or_create_collection(self, name: str) -> "Collection":
+        """Get or create the collection on every shard, return the one of the first shard.
+
+        A compaction interrupted by a crash is recovered first, so the collection is not created again empty.
+        """
+
+        def _get_or_create(shard: int) -> "Collection":
+            self._recover_compaction(name=name, shard=shard)
+            return self.clients[shard].get_or_create_collection(name=name)
+
+        try:
+            collections = self._map_shards(_get_or_create)
+        except Exception as e:
+            msg = f"Failed to get or create Collection({name})"
+            self.logger.exception("%s: %s", msg, e)
+            raise VectorStoreError(msg) from e
+        self._known_collections.add(name)
+        return collections[0]
+
+    @classmethod
+    def is_reserved_name(cls, name: str) -> bool:
+        """Collection names used by the store itself, which cannot be a tenant collection"""
+        return name == cls.DEFAULT_COLLECTION_NAME or name.endswith((cls.COMPACTING_SUFFIX, cls.REPLACED_SUFFIX))
+
+    def _tenant_names(self) -> set[str]:
+        names = {
+            col.name.removesuffix(self.COMPACTING_SUFFIX).removesuffix(self.REPLACED_SUFFIX)
+            for col in self.chromadb_client.list_collections()
+        }
+        return names - {self.DEFAULT_COLLECTION_NAME}
+
+    @_locked
+    def ensure_tenant_collection(self, name: str) -> None:
+        """Get or create the collection of a tenant, a new one only while there are less than `max_tenants`"""
+        if name in self._known_collections:
+            return
+        if self.max_tenants is not None:
+            tenant_names = self._tenant_names()
+            if name not in tenant_names and len(tenant_names) >= self.max_tenants:
+                raise TenantLimitError(max_tenants=self.max_tenants)
+        self.get_or_create_collection(name=name)
+
+    @_locked
+    def count(self, collection_name: str) -> int:
+        """Number of chunks of the collection over all shards"""
+        return sum(self._map_shards(lambda shard: self.get_collection(name=collection_name, shard=shard).count()))
+
+    def _check_quota(self, collection_name: str, added_count: int) -> None:
+        if self.max_chunks is not None and self.count(collection_name=collection_name) + added_count > self.max_chunks:
+            raise QuotaExceededError(collection_name=collection_name, max_chunks=self.max_chunks)
+
+    @_locked
     def add_multiple_document_chunks(
-        self, chunks: Iterable[DocumentChunk], collection_name: str = DEFAULT_COLLECTION_NAME
+        self, chunks: ChunkBatch | Iterable[DocumentChunk], collection_name: str = DEFAULT_COLLECTION_NAME
     ) -> None:
+        """Add the chunks, each to the shard owning its document, embedded and written `batch_size` chunks at a time"""
         try:
-            collection = self.get_collection(name=collection_name)
-            ids, metas, docs = zip(
-                *((chunk.id, chunk.metadata.model_dump(), chunk.text) for chunk in chunks), strict=True
-            )
-            collection.add(ids=list(ids), metadatas=list(metas), documents=list(docs))  # chroma check for type list
+            ids, metas, docs = self._chunk_columns(chunks=chunks)
+            if not ids:
+                raise ValueError("No chunk to add")
+            self._check_quota(collection_name=collection_name, added_count=len(ids))
+            rows_by_shard: dict[int, list[int]] = defaultdict(list)
+            for row, meta in enumerate(metas):
+                rows_by_shard[self.shard_of(document_id=meta["document_id"])].append(row)
+
+            def _add(shard: int) -> None:
+                collection = self.get_collection(name=collection_name, shard=shard)
+                for rows in _batched(rows_by_shard[shard], batch_size=self.batch_size):
+                    self._write_chunks(
+                        collection=collection,
+                        ids=[ids[row] for row in rows],
+                        metas=[metas[row] for row in rows],
+                        docs=[docs[row] for row in rows],
+                        shard=shard,
+                    )
+
+            self._map_shards(_add, shards=rows_by_shard)
+        except QuotaExceededError:
+            raise
         except Exception as e:
             msg = f"Failed to add chunks to Collection({collection_name})"
             self.logger.exception("%s: %s", msg, e)
             raise VectorStoreError(msg) from e
 
+    def _chunk_columns(self, chunks: ChunkBatch | Iterable[DocumentChunk]) -> tuple[list[str], list[dict], list[str]]:
+        """Return the ids, chromadb metadatas (with the content hash) and texts of the chunks"""
+        if isinstance(chunks, ChunkBatch):
+            ids, metas, docs = chunks.ids, chunks.metadatas(), chunks.texts
+        else:
+            ids, metas, docs = [], [], []
+            for chunk in chunks:
+                ids.append(chunk.id)
+                metas.append(chunk.metadata.model_dump())
+                docs.append(chunk.text)
+        for meta, text in zip(metas, docs, strict=True):
+            meta[self.CONTENT_HASH_KEY] = _content_hash(text=text)
+        return ids, metas, docs
+
+    @_locked
+    def update_document_chunks(
+        self,
+        document_id: str,
+        chunks: ChunkBatch | Iterable[DocumentChunk],
+        collection_name: str = DEFAULT_COLLECTION_NAME,
+    ) -> DocumentUpdateResult:
+        """Replace the chunks of a document, only chunks whose content changed are re-embedded"""
+        shard = self.shard_of(document_id=document_id)
+        collection = self.get_collection(name=collection_name, shard=shard)
+        existing = collection.get(where={"document_id": {"$eq": document_id}}, include=["metadatas"])
+        if not existing["ids"]:
+            raise DocumentNotFoundError(document_id=document_id)
+        existing_hashes = {
+            c_id: meta.get(self.CONTENT_HASH_KEY)
+            for c_id, meta in zip(existing["ids"], existing["metadatas"], strict=True)
+        }
+        hash_to_existing_id = {c_hash: c_id for c_id, c_hash in existing_hashes.items() if c_hash}
+
+        result = DocumentUpdateResult()
+        to_embed: list[tuple[str, dict, str]] = []
+        to_copy: list[tuple[str, dict, str, str]] = []  # reuse embedding of an existing chunk with same content
+        new_ids = set()
+        for c_id, meta, text in zip(*self._chunk_columns(chunks=chunks), strict=True):
+            new_ids.add(c_id)
+            c_hash = meta[self.CONTENT_HASH_KEY]
+            if existing_hashes.get(c_id) == c_hash:
+                result.unchanged += 1
+            elif c_hash in hash_to_existing_id:
+                to_copy.append((c_id, meta, text, hash_to_existing_id[c_hash]))
+            else:
+                to_embed.append((c_id, meta, text))
+            if c_id in existing_hashes and existing_hashes[c_id] != c_hash:
+                result.updated += 1
+            elif c_id not in existing_hashes:
+                result.added += 1
+
+        result.embedded = len(to_embed)
+        self._check_quota(collection_name=collection_name, added_count=len(new_ids) - len(existing_hashes))
+        msg = f"update Document({document_id}) in Collection({collection_name})"
+        try:
+            # read all reused embeddings before writing, the writes can overwrite the chunks they are copied from
+            src_embeddings = (
+                self._get_embeddings(collection=collection, ids=list({c[3] for c in to_copy})) if to_copy else {}
+            )
+            for batch in _batched(to_copy, batch_size=self.batch_size):
+                ids, metas, docs, src_ids = zip(*batch, strict=True)
+                self._write_chunks(
+                    collection=collection,
+                    ids=list(ids),
+                    metas=list(metas),
+                    docs=list(docs),
+                    embeddings=[src_embeddings[src_id] for src_id in src_ids],
+                    upsert=True,
+                    shard=shard,
+                )
+            for batch in _batched(to_embed, batch_size=self.batch_size):
+                ids, metas, docs = zip(*batch, strict=True)
+                self._write_chunks(
+                    collection=collection, ids=list(ids), metas=list(metas), docs=list(docs), upsert=True, shard=shard
+                )
+            stale_ids = [c_id for c_id in existing_hashes if c_id not in new_ids]
+            result.deleted = self._delete_ids(collection=collection, ids=stale_ids, shard=shard)
+        except Exception as e:
+            self.logger.exception("Failed to %s: %s", msg, e)
+            raise VectorStoreError(f"Failed to {msg}") from e
+
+        self.logger.info("%s: %s", msg, result)
+        self._maybe_compact(collection_name=collection_name, shard=shard)
+        return result
+
+    @_locked
+    def delete_document(self, document_id: str, collection_name: str = DEFAULT_COLLECTION_NAME) -> int:
+        shard = self.shard_of(document_id=document_id)
+        collection = self.get_collection(name=collection_name, shard=shard)
+        ids = collection.get(where={"document_id": {"$eq": document_id}}, include=[])["ids"]
+        if not ids:
+            raise DocumentNotFoundError(document_id=document_id)
+        msg = f"delete Document({document_id}) from Collection({collection_name})"
+        try:
+            deleted = self._delete_ids(collection=collection, ids=ids, shard=shard)
+        except Exception as e:
+            self.logger.exception("Failed to %s: %s", msg, e)
+            raise VectorStoreError(f"Failed to {msg}") from e
+        self.logger.info("%s: deleted %s chunks", msg, deleted)
+        self._maybe_compact(collection_name=collection_name, shard=shard)
+        return deleted
+
+    def _delete_ids(self, collection: "Collection", ids: list[str], shard: int = 0) -> int:
+        def _delete(target: "Collection") -> None:
+            for batch in _batched(ids, batch_size=self.batch_size):
+                target.delete(ids=batch)
+
+        self._write_live(collection=collection, write=_delete, shard=shard)
+        index = self._quantized_index(collection_name=collection.name, shard=shard)
+        if index is not None:
+            index.delete(ids=ids)
+        self._deleted_counts[shard, collection.name] += len(ids)
+        return len(ids)
+
+    def _maybe_compact(self, collection_name: str, shard: int = 0) -> None:
+        """Compact in background once enough chunks are deleted"""
+        deleted = self._deleted_counts[shard, collection_name]
+        if not deleted:
+            return
+        count = self.get_collection(name=collection_name, shard=shard).count()
+        if deleted / max(count + deleted, 1) >= self.compaction_deleted_ratio:
+            self.schedule_compaction(name=collection_name, shard=shard)
+
+    def schedule_compaction(self, name: str, shard: int = 0) -> Future:
+        """Compact the collection in the compaction thread, unless it is already scheduled"""
+        key = (shard, name)
+        future = self._compactions.get(key)
+        if future is None or future.done():
+            future = self._compaction_executor.submit(self.compact_collection, name=name, shard=shard)
+            self._compactions[key] = future
+        return future
+
+    def wait_compactions(self) -> None:
+        for future in list(self._compactions.values()):
+            future.exception()  # failures are logged by compact_collection
+
+    @classmethod
+    def _without_lease(cls, metadata: dict | None) -> dict:
+        """Collection metadata without the compaction lease"""
+        lease_keys = (cls.LEASE_OWNER_KEY, cls.LEASE_PHASE_KEY, cls.LEASE_UNTIL_KEY)
+        return {key: value for key, value in (metadata or {}).items() if key not in lease_keys}
+
+    def _is_leased(self, metadata: dict | None) -> bool:
+        lease_until: float = (metadata or {}).get(self.LEASE_UNTIL_KEY, 0)
+        return lease_until > time.time()
+
+    def _is_swapping(self, metadata: dict | None) -> bool:
+        """Whether a compaction of another process is swapping the collection, writes have to wait for it"""
+        metadata = metadata or {}
+        return (
+            self._is_leased(metadata=metadata)
+            and metadata.get(self.LEASE_PHASE_KEY) == "swap"
+            and metadata.get(self.LEASE_OWNER_KEY) != self._lease_owner
+        )
+
+    def _set_lease(self, collection: "Collection", phase: str | None) -> None:
+        """Lease the collection to the compaction for `compaction_lease_seconds`, release it if `phase` is None"""
+        collection.modify(
+            metadata={
+                **self._without_lease(metadata=collection.metadata),
+                self.LEASE_OWNER_KEY: self._lease_owner,
+                self.LEASE_PHASE_KEY: phase or "",
+                self.LEASE_UNTIL_KEY: time.time() + self.compaction_lease_seconds if phase else 0.0,
+            }
+        )
+
+    def _recover_compaction(self, name: str, shard: int) -> None:
+        """Finish the swap of a compaction interrupted after its copy, drop the copy of an interrupted one.
+
+        Nothing is done while the collection is leased, its compaction may still be running in another process.
+        """
+        client = self.clients[shard]
+        compacting_name, replaced_name = f"{name}{self.COMPACTING_SUFFIX}", f"{name}{self.REPLACED_SUFFIX}"
+        collections = {collection.name: collection for collection in client.list_collections()}
+        names = set(collections)
+        if not names & {compacting_name, replaced_name}:
+            return
+        if any(self._is_leased(metadata=collections[n].metadata) for n in names & {name, replaced_name}):
+            return
+        if replaced_name in names and name not in names:
+            # the copy is complete once the live collection got renamed, else restore the live collection
+            source = compacting_name if compacting_name in names else replaced_name
+            client.get_collection(name=source).modify(name=name)
+            names = names - {source} | {name}
+        for stale_name in names & {compacting_name, replaced_name}:
+            client.delete_collection(name=stale_name)
+        self.logger.warning("Recovered interrupted compaction of Collection(%s)", name)
+
+    def _copy_rows(self, rows: "GetResult", target: "Collection") -> None:
+        target.upsert(
+            ids=rows["ids"],
+            embeddings=rows["embeddings"],
+            metadatas=rows["metadatas"],
+            documents=rows["documents"],
+        )
+
+    def _sync_copy(self, source: "Collection", target: "Collection") -> None:
+        """Copy the chunks written to `source` since they were copied to `target`, delete the ones deleted since"""
+        source_rows = source.get(include=["metadatas"])
+        target_rows = target.get(include=["metadatas"])
+        source_metas = dict(zip(source_rows["ids"], source_rows["metadatas"], strict=True))  # type: ignore
+        target_metas = dict(zip(target_rows["ids"], target_rows["metadatas"], strict=True))  # type: ignore
+        changed_ids = [c_id for c_id, meta in source_metas.items() if target_metas.get(c_id) != meta]
+        for batch in _batched(changed_ids, batch_size=self.batch_size):
+            rows = source.get(ids=batch, include=["embeddings", "metadatas", "documents"])
+            self._copy_rows(rows=rows, target=target)
+        deleted_ids = [c_id for c_id in target_metas if c_id not in source_metas]
+        for batch in _batched(deleted_ids, batch_size=self.batch_size):
+            target.delete(ids=batch)
+
+    def compact_collection(self, name: str, shard: int | None = None) -> None:
+        """Rebuild the collection index from the stored embeddings, dropping the space left by deleted chunks.
+
+        The chunks are copied to a new collection while the collection stays in use and leased to the compaction. The
+        lease then blocks the writes of other processes, the chunks written meanwhile are synced and the collections
+        swapped under the store lock. Compact the collection on every shard if `shard` is not given.
+        """
+        if shard is None:
+            self._map_shards(lambda s: self.compact_collection(name=name, shard=s))
+            return
+        client = self.clients[shard]
+        include: list = ["embeddings", "metadatas", "documents"]
+        msg = f"compact Collection({name})"
+        collection = tmp_collection = None
+        try:
+            with self._lock:
+                self._recover_compaction(name=name, shard=shard)
+                collection = self.get_collection(name=name, shard=shard)
+                if self._is_leased(metadata=collection.metadata):
+                    self.logger.info("Skip %s, it is already being compacted", msg)
+                    return
+                tmp_metadata = self._without_lease(metadata=collection.metadata) or None
+                self._set_lease(collection=collection, phase="copy")
+                # only one compaction can create the copy, even if several processes got the lease at the same time
+                tmp_collection = client.create_collection(name=f"{name}{self.COMPACTING_SUFFIX}", metadata=tmp_metadata)
+                ids = collection.get(include=[])["ids"]
+            for batch in _batched(ids, batch_size=self.batch_size):
+                self._copy_rows(rows=collection.get(ids=batch, include=include), target=tmp_collection)
+                self._set_lease(collection=collection, phase="copy")
+            with self._lock:
+                self._set_lease(collection=collection, phase="swap")
+                self._sync_copy(source=collection, target=tmp_collection)
+                # the live collection is only deleted once the copy has its name, see _recover_compaction
+                collection.modify(name=f"{name}{self.REPLACED_SUFFIX}")
+                try:
+                    tmp_collection.modify(name=name)
+                except Exception:
+                    collection.modify(name=name)  # the copy is gone, keep the live collection
+                    raise
+                client.delete_collection(name=collection.name)
+                if (index := self._quantized_index(collection_name=name, shard=shard)) is not None:
+                    index.compact()
+                self._deleted_counts[shard, name] = 0
+                if name == self.DEFAULT_COLLECTION_NAME and shard == 0:
+                    self.default_collection = tmp_collection
+        except Exception as e:
+            if collection is not None and tmp_collection is not None:
+                with suppress(Exception):
+                    self._set_lease(collection=collection, phase=None)
+            self.logger.exception("Failed to %s: %s", msg, e)
+            raise VectorStoreError(f"Failed to {msg}") from e
+        self.logger.info("%s with %s chunks", msg, tmp_collection.count())
+
     def search(
         self,
         query: str,
-        n_results: int = 3,
+        n_results: int | None = None,
         collection_name: str = DEFAULT_COLLECTION_NAME,
         document_ids: list[str] | None = None,
+        rerank: bool = True,
     ) -> list[DocumentChunk]:
-        collection = self.get_collection(name=collection_name)
+        return self.search_batch(
+            query=query,
+            n_results=n_results,
+            collection_name=collection_name,
+            document_ids=document_ids,
+            rerank=rerank,
+        ).to_document_chunks()
+
+    @_locked
+    def search_batch(
+        self,
+        query: str,
+        n_results: int | None = None,
+        collection_name: str = DEFAULT_COLLECTION_NAME,
+        document_ids: list[str] | None = None,
+        rerank: bool = True,
+    ) -> RetrievedChunks:
+        """Return the chunks closer than the distance threshold, over-fetched and reranked if a reranker is set.
+
+        All shards are queried in parallel and their results merged by distance, document filtered queries only go to
+        the shards owning the documents.
+        """
+        n_results = n_results or self.retrieval_cfg.n_results
+        reranker = self.reranker if rerank else None
+        shards = sorted({self.shard_of(document_id=doc_id) for doc_id in document_ids}) if document_ids else None
+        collections = {
+            shard: self.get_collection(name=collection_name, shard=shard)
+            for shard in (shards if shards is not None else range(self.shard_count))
+        }
         where = None
         if document_ids:
             where = {"document_id": {"$in": document_ids}}
@@ -71,31 +711,110 @@ class VectorStore(metaclass=ThreadUnsafeSingletonMeta):
         msg = f"Query Collection({collection_name}) with {query}"
         if where:
             msg += f" where({where})"
-        try:
-            res = collection.query(
-                query_texts=query,
-                n_results=n_results,
-                where=where,
-                include=["metadatas", "documents", "distances"],
+        n_fetch = max(n_results, self.retrieval_cfg.fetch_k) if reranker else n_results
+
+        def _query(shard: int) -> dict:
+            collection = collections[shard]
+            index = self._quantized_index(collection_name=collection_name, shard=shard)
+            if index is not None and len(index) != collection.count():
+                self._sync_quantized_index(collection=collection, index=index)
+            if index is not None and len(index):
+                return self._query_quantized(
+                    collection=collection,
+                    index=index,
+                    query=query,
+                    n_results=n_fetch,
+                    where=where,
+                    with_embeddings=reranker is not None,
+                )
+            return dict(
+                collection.query(
+                    query_texts=query,
+                    n_results=n_fetch,
+                    where=where,
+                    include=(
+                        ["metadatas", "documents", "distances", "embeddings"]
+                        if reranker
+                        else ["metadatas", "documents", "distances"]
+                    ),
+                )
             )
+
+        try:
+            results = self._map_shards(_query, shards=collections)
         except Exception as e:
             self.logger.exception("Failed to %s: %s", msg, e)
             raise VectorStoreError(f"Failed to {msg}") from e
+        res = results[0] if len(results) == 1 else _merge_query_results(results=results, n_results=n_fetch)
 
-        ret_chunks = [
-            DocumentChunk(id=c_id, text=text, metadata=DocumentChunkMetadata(**meta))
-            for c_id, text, meta, score in zip(
-                res["ids"][0], res["documents"][0], res["metadatas"][0], res["distances"][0], strict=True
+        candidates = [idx for idx, score in enumerate(res["distances"][0]) if score < self.distance_score_threshold]
+        if reranker and len(candidates) > n_results:
+            selected = reranker.rerank(
+                query=query,
+                ids=[res["ids"][0][idx] for idx in candidates],
+                content_hashes=[res["metadatas"][0][idx].get(self.CONTENT_HASH_KEY) for idx in candidates],
+                distances=[res["distances"][0][idx] for idx in candidates],
+                embeddings=[res["embeddings"][0][idx] for idx in candidates],
+                top_k=n_results,
             )
-            if score < self.distance_score_threshold
-        ]
+            candidates = [candidates[idx] for idx in selected]
+        candidates = candidates[:n_results]
+        ret_chunks = RetrievedChunks(
+            ids=[res["ids"][0][idx] for idx in candidates],
+            texts=[res["documents"][0][idx] for idx in candidates],
+            metadatas=[res["metadatas"][0][idx] for idx in candidates],
+            distances=[res["distances"][0][idx] for idx in candidates],
+        )
         self.logger.info("%s got %s results", msg, len(ret_chunks))
         return ret_chunks
 
+    def _sync_quantized_index(self, collection: "Collection", index: "QuantizedIndex") -> None:
+        """Rebuild the side index from the chroma embeddings, for chunks written elsewhere or before a restart"""
+        ids = collection.get(include=[])["ids"]
+        deleted = index.delete(ids=set(index.rows) - set(ids))
+        missing_ids = [c_id for c_id in ids if c_id not in index.rows]
+        for batch in _batched(missing_ids, batch_size=self.batch_size):
+            rows = collection.get(ids=batch, include=["embeddings"])
+            index.add(ids=rows["ids"], vectors=rows["embeddings"])  # type: ignore
+        self.logger.info(
+            "Synced quantized index of Collection(%s): added %s, deleted %s", collection.name, len(missing_ids), deleted
+        )
+
+    def _query_quantized(  # noqa: PLR0913
+        self,
+        collection: "Collection",
+        index: "QuantizedIndex",
+        query: str,
+        n_results: int,
+        where: dict | None,
+        with_embeddings: bool,
+    ) -> dict:
+        """Same result format as `Collection.query` with a single query text"""
+        allowed_ids = collection.get(where=where, include=[])["ids"] if where else None
+        hits = index.search(
+            query=self._embed(texts=[query])[0],
+            k=n_results,
+            rescore_k=n_results * self.rescore_factor,
+            allowed_ids=allowed_ids,
+        )
+        hits = [(c_id, distance) for c_id, distance in hits if distance < self.distance_score_threshold]
+        res = collection.get(ids=[c_id for c_id, _ in hits], include=["metadatas", "documents"]) if hits else None
+        found = {c_id: idx for idx, c_id in enumerate(res["ids"])} if res else {}
+        hits = [(c_id, distance) for c_id, distance in hits if c_id in found]
+        ids = [c_id for c_id, _ in hits]
+        return {
+            "ids": [ids],
+            "distances": [[distance for _, distance in hits]],
+            "documents": [[res["documents"][found[c_id]] for c_id in ids]] if res else [[]],  # type: ignore
+            "metadatas": [[res["metadatas"][found[c_id]] for c_id in ids]] if res else [[]],  # type: ignore
+            "embeddings": [index.get_vectors(ids=ids).tolist()] if with_embeddings else None,
+        }
+
+    @_locked
     def get_chunk_by_document_id(
         self, document_id: str, collection_name: str = DEFAULT_COLLECTION_NAME, **kwargs: Any
     ) -> list[DocumentChunk]:
-        collection = self.get_collection(name=collection_name)
+        collection = self.get_collection(name=collection_name, shard=self.shard_of(document_id=document_id))
 
         res = collection.get(where={"document_id": {"$eq": document_id}}, include=["metadatas", "documents"], **kwargs)
 
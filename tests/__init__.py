@@ -1,4 +1,11 @@
 from pathlib import Path
+from typing import Any, Protocol, TypeVar
 
 TEST_DIR_PATH = Path(__file__).parent.resolve()
 RESOURCE_DIR_PATH = TEST_DIR_PATH / "resources"
+
+T = TypeVar("T")
+
+
+class SingletonFactory(Protocol):
+    def __call__(self, cls: type[T], *args: Any, **kwargs: Any) -> T: ...
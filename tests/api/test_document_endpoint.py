@@ -0,0 +1,60 @@
+from pathlib import Path
+from uuid import uuid4
+
+from httpx import Client, codes
+
+from src.app import PATHS, DeleteDocumentResponse, UpdateDocumentResponse, UploadFileResponse
+from src.vector_store import VectorStore
+
+
+def _upload_text(client: Client, file_path: Path, content: str) -> str:
+    with file_path.open(mode="w") as f:
+        f.write(content)
+    response = client.post(url=PATHS.upload_file, files={"file": file_path.open(mode="rb")})
+    assert response.status_code == codes.OK
+    return UploadFileResponse.model_validate(response.json()).document_id
+
+
+def test_update_document(client: Client, vector_store: VectorStore, tmpdir: Path) -> None:
+    tmp_txt_file = tmpdir / "text_file.txt"
+    doc_id = _upload_text(client=client, file_path=tmp_txt_file, content="Some Content")
+
+    response = client.put(url=PATHS.document.format(document_id=doc_id), files={"file": tmp_txt_file.open(mode="rb")})
+    assert response.status_code == codes.OK
+    resp_model = UpdateDocumentResponse.model_validate(response.json())
+    assert resp_model.unchanged == 1 and resp_model.updated == 0, "Expected no chunk to be re-embedded"
+
+    new_content = "Some New Content"
+    with tmp_txt_file.open(mode="w") as f:
+        f.write(new_content)
+    response = client.put(url=PATHS.document.format(document_id=doc_id), files={"file": tmp_txt_file.open(mode="rb")})
+    assert response.status_code == codes.OK
+    resp_model = UpdateDocumentResponse.model_validate(response.json())
+    assert resp_model.updated == 1, "Expected changed chunk to be updated"
+    chunks = vector_store.get_chunk_by_document_id(document_id=doc_id)
+    assert len(chunks) == 1 and chunks[0].text == new_content, f"Expected document content to be {new_content}"
+
+    vector_store.delete_document(document_id=doc_id)
+
+
+def test_delete_document(client: Client, vector_store: VectorStore, tmpdir: Path) -> None:
+    doc_id = _upload_text(client=client, file_path=tmpdir / "text_file.txt", content="Some Content")
+
+    response = client.delete(url=PATHS.document.format(document_id=doc_id))
+    assert response.status_code == codes.OK
+    resp_model = DeleteDocumentResponse.model_validate(response.json())
+    assert resp_model.deleted_chunks == 1
+    assert not vector_store.get_chunk_by_document_id(document_id=doc_id), "Expected document chunks to be deleted"
+
+    response = client.delete(url=PATHS.document.format(document_id=doc_id))
+    assert response.status_code == codes.NOT_FOUND
+
+
+def test_update_unknown_document(client: Client, tmpdir: Path) -> None:
+    tmp_txt_file = tmpdir / "text_file.txt"
+    with tmp_txt_file.open(mode="w") as f:
+        f.write("Some Content")
+    response = client.put(
+        url=PATHS.document.format(document_id=str(uuid4())), files={"file": tmp_txt_file.open(mode="rb")}
+    )
+    assert response.status_code == codes.NOT_FOUND
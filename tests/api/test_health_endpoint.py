@@ -6,3 +6,9 @@ from src.app import PATHS
 def test_health_endpoint(client: Client) -> None:
     resp = client.get(url=PATHS.health_check)
     assert resp.status_code == codes.OK
+
+
+def test_ready_endpoint(client: Client) -> None:
+    resp = client.get(url=PATHS.ready)
+    assert resp.status_code == codes.OK
+    assert resp.json()["status"] == "READY"
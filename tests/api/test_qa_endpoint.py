@@ -1,11 +1,15 @@
+import asyncio
 import re
+import threading
+import time
 from uuid import uuid4
 
 import pytest
 from httpx import Client, Response, codes
 
-from src.app import IDK_ANSWER, PATHS, QARequest, QAResponse
+from src.app import IDK_ANSWER, PATHS, QARequest, QAResponse, _run_cancellable, app, get_llm_service
 from src.docs import DocumentChunk, DocumentChunkMetadata
+from src.llm import GenerationCancelledError, ThroughputMeter
 from src.vector_store import VectorStore
 
 # noinspection PyUnresolvedReferences
@@ -17,6 +21,7 @@ from .test_upload_endpoint import upload_example_pdf_file  # noqa: F401
     [
         {},
         {"questionnn": "Is Cobra venomous?"},
+        {"question": "Is Cobra venomous?", "timeout": 0},
     ],
 )
 def test_qa_endpoint_bad_request(client: Client, req_json: dict) -> None:
@@ -58,3 +63,77 @@ def test_qa_endpoint_filter_document(
         url=PATHS.qa, json=QARequest(question="Is Cobra venomous?", document_ids=[upload_example_pdf_file]).model_dump()
     )
     _assert_correct_cobra_qa_response(resp=resp)
+
+
+def test_qa_endpoint_extractive_mode(client: Client, upload_example_pdf_file: str) -> None:  # noqa: F811
+    req = QARequest(
+        question="Which genus do most cobras belong to?",
+        document_ids=[upload_example_pdf_file],
+        answer_mode="extractive",
+    )
+    resp = client.post(url=PATHS.qa, json=req.model_dump())
+    assert resp.status_code == codes.OK
+    resp = QAResponse.model_validate(resp.json())
+    assert resp.answer_mode == "extractive"
+    assert "Naja" in resp.answer, "Expected Naja in answer"
+
+
+class _BlockingLLMService:
+    """Generate until cancelled"""
+
+    def __init__(self) -> None:
+        self.throughput = ThroughputMeter()
+        self.cancelled = threading.Event()
+
+    def answer_question_based_on_sources(self, question: str, sources: list[str], cancel: threading.Event) -> str:
+        cancel.wait(timeout=10)
+        self.cancelled.set()
+        raise GenerationCancelledError
+
+
+def test_qa_endpoint_deadline_aborts_generation(
+    client: Client, vector_store: VectorStore, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    question = "Is Cobra venomous?"
+    doc_id = str(uuid4())
+    vector_store.add_multiple_document_chunks(
+        chunks=[
+            DocumentChunk(id=str(uuid4()), text=question, metadata=DocumentChunkMetadata(page=0, document_id=doc_id))
+        ]
+    )
+    llm_service = _BlockingLLMService()
+    monkeypatch.setitem(app.dependency_overrides, get_llm_service, lambda: llm_service)
+    try:
+        req = QARequest(question=question, document_ids=[doc_id], answer_mode="llm", timeout=0.2)
+        resp = client.post(url=PATHS.qa, json=req.model_dump())
+        assert resp.status_code == codes.GATEWAY_TIMEOUT
+        assert llm_service.cancelled.is_set(), "Expected generation cancelled once the deadline passed"
+    finally:
+        vector_store.delete_document(document_id=doc_id)
+
+
+class _ConnectedRequest:
+    async def is_disconnected(self) -> bool:
+        return False
+
+
+def test_cancelled_handler_waits_for_generation_to_stop() -> None:
+    stopped = threading.Event()
+
+    def _generate(cancel: threading.Event) -> str:
+        cancel.wait(timeout=10)
+        time.sleep(0.05)  # the cancel event is only checked between tokens
+        stopped.set()
+        raise GenerationCancelledError
+
+    async def _main() -> None:
+        task = asyncio.ensure_future(
+            _run_cancellable(request=_ConnectedRequest(), deadline=None, func=_generate)  # type: ignore
+        )
+        await asyncio.sleep(0.05)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        assert stopped.is_set(), "Expected the LLM slot kept until the generation stopped"
+
+    asyncio.run(_main())
@@ -0,0 +1,59 @@
+from pathlib import Path
+
+import pytest
+from httpx import Client, codes
+
+from src.app import PATHS, TENANT_HEADER, UploadFileResponse
+from src.vector_store import VectorStore
+
+
+def _upload_text(client: Client, file_path: Path, tenant: str) -> str:
+    with file_path.open(mode="w") as f:
+        f.write("Some Content")
+    response = client.post(
+        url=PATHS.upload_file, files={"file": file_path.open(mode="rb")}, headers={TENANT_HEADER: tenant}
+    )
+    assert response.status_code == codes.OK
+    return UploadFileResponse.model_validate(response.json()).document_id
+
+
+def test_upload_to_tenant_collection(client: Client, vector_store: VectorStore, tmpdir: Path) -> None:
+    tenant = "tenant-a"
+    doc_id = _upload_text(client=client, file_path=tmpdir / "text_file.txt", tenant=tenant)
+    assert vector_store.get_chunk_by_document_id(document_id=doc_id, collection_name=tenant)
+    assert not vector_store.get_chunk_by_document_id(document_id=doc_id), "Expected no chunk in default collection"
+    vector_store.delete_document(document_id=doc_id, collection_name=tenant)
+
+
+def test_tenant_storage_quota(
+    client: Client, vector_store: VectorStore, tmpdir: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setattr(vector_store, "max_chunks", 0)
+    tmp_txt_file = tmpdir / "text_file.txt"
+    with tmp_txt_file.open(mode="w") as f:
+        f.write("Some Content")
+    response = client.post(
+        url=PATHS.upload_file, files={"file": tmp_txt_file.open(mode="rb")}, headers={TENANT_HEADER: "tenant-b"}
+    )
+    assert response.status_code == codes.REQUEST_ENTITY_TOO_LARGE
+
+
+@pytest.mark.parametrize("tenant", ["a", VectorStore.DEFAULT_COLLECTION_NAME, f"tenant{VectorStore.COMPACTING_SUFFIX}"])
+def test_invalid_tenant(client: Client, tenant: str) -> None:
+    response = client.post(url=PATHS.qa, json={"question": "Is Cobra venomous?"}, headers={TENANT_HEADER: tenant})
+    assert response.status_code == codes.BAD_REQUEST
+
+
+def test_tenant_limit(client: Client, vector_store: VectorStore, tmpdir: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    existing_tenant = "tenant-c"
+    vector_store.ensure_tenant_collection(name=existing_tenant)
+    collection_names = {col.name for col in vector_store.chromadb_client.list_collections()}
+    monkeypatch.setattr(vector_store, "max_tenants", len(collection_names - {VectorStore.DEFAULT_COLLECTION_NAME}))
+    monkeypatch.setattr(vector_store, "_known_collections", set())  # as after a restart
+
+    response = client.post(
+        url=PATHS.qa, json={"question": "Is Cobra venomous?"}, headers={TENANT_HEADER: "tenant-over-limit"}
+    )
+    assert response.status_code == codes.FORBIDDEN
+    doc_id = _upload_text(client=client, file_path=tmpdir / "text_file.txt", tenant=existing_tenant)
+    vector_store.delete_document(document_id=doc_id, collection_name=existing_tenant)
@@ -6,6 +6,7 @@ import pytest
 from httpx import Client, Response, codes
 
 from src.app import PATHS, UploadFileResponse
+from src.config import CONFIGS
 from src.docs import DocumentParsingError
 from src.vector_store import VectorStore
 from tests.test_docs_parsing import EXAMPLE_PDF_FILE, EXAMPLE_PDF_FILE_EXPECTED_CHUNK_COUNT
@@ -63,3 +64,53 @@ def test_upload_invalid_pdf_file(client: Client, tmpdir: Path) -> None:
     response = client.post(url=PATHS.upload_file, files={"file": tmp_txt_file.open(mode="rb")})
     assert response.status_code == codes.INTERNAL_SERVER_ERROR
     assert DocumentParsingError.__name__ in response.text
+
+
+def test_upload_latin1_text_file(client: Client, vector_store: VectorStore) -> None:
+    content = "Le café est crème"
+    response = client.post(
+        url=PATHS.upload_file,
+        files={"file": ("text_file.txt", content.encode("latin-1"), "text/plain; charset=latin-1")},
+    )
+    doc_id = _assert_valid_upload_file_response(response=response).document_id
+    chunks = vector_store.get_chunk_by_document_id(document_id=doc_id)
+    assert [chunk.text for chunk in chunks] == [content]
+
+
+def test_upload_unknown_charset(client: Client) -> None:
+    response = client.post(
+        url=PATHS.upload_file, files={"file": ("text_file.txt", b"Some Content", "text/plain; charset=unknown")}
+    )
+    assert response.status_code == codes.BAD_REQUEST
+    assert response.json() == {"detail": "Unknown charset: unknown"}
+
+
+def test_upload_too_large_file(client: Client, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(CONFIGS.docs, "max_text_upload_mb", 1)
+    files = {"file": ("text_file.txt", b"a" * (1024 * 1024 + 1), "text/plain")}
+    response = client.post(url=PATHS.upload_file, files=files)
+    assert response.status_code == codes.REQUEST_ENTITY_TOO_LARGE, "Expected text upload size limit"
+
+    monkeypatch.setattr(CONFIGS.docs, "max_pdf_upload_mb", 1)
+    response = client.post(url=PATHS.upload_file, files=files)
+    assert response.status_code == codes.REQUEST_ENTITY_TOO_LARGE, "Expected rejection from Content-Length"
+    assert response.json() == {"detail": "Upload exceeds 1 MB"}
+
+
+def test_upload_too_large_chunked_file(client: Client, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(CONFIGS.docs, "max_text_upload_mb", 1)
+    monkeypatch.setattr(CONFIGS.docs, "max_pdf_upload_mb", 1)
+    boundary = "upload-boundary"
+    parts = [
+        f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="text_file.txt"\r\n'.encode(),
+        b"Content-Type: text/plain\r\n\r\n",
+        *[b"a" * 1024 * 256 for _ in range(5)],
+        f"\r\n--{boundary}--\r\n".encode(),
+    ]
+    response = client.post(
+        url=PATHS.upload_file,
+        content=iter(parts),  # streamed without Content-Length
+        headers={"Content-Type": f"multipart/form-data; boundary={boundary}"},
+    )
+    assert response.status_code == codes.REQUEST_ENTITY_TOO_LARGE, "Expected rejection while receiving the body"
+    assert response.json() == {"detail": "Upload exceeds 1 MB"}
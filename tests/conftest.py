@@ -1,6 +1,8 @@
 import os
+from collections.abc import Iterator
 from logging import Logger
 from pathlib import Path
+from typing import Any, TypeVar
 
 import pytest
 from fastapi import FastAPI
@@ -10,10 +12,12 @@ from httpx import Client
 from src.app import app, get_llm_service, get_vector_store
 from src.llm import LLMService
 from src.logging import get_logger
+from src.singleton import ThreadUnsafeSingletonMeta
 from src.vector_store import VectorStore
-from tests import TEST_DIR_PATH
+from tests import TEST_DIR_PATH, SingletonFactory
 
 TEST_OUTPUTS_DIR_PATH = TEST_DIR_PATH / "outputs"
+T = TypeVar("T")
 
 
 class _FLAGS:
@@ -76,6 +80,24 @@ def client(request: pytest.FixtureRequest, application: FastAPI) -> Client:
     return TestClient(app=application)
 
 
+@pytest.fixture
+def fresh_singleton() -> Iterator[SingletonFactory]:
+    """Create a new instance of a singleton class for the test, the previous instance is restored after it"""
+    instances = ThreadUnsafeSingletonMeta._instances
+    replaced: dict[type, Any] = {}
+
+    def _create(cls: type[T], *args: Any, **kwargs: Any) -> T:
+        replaced.setdefault(cls, instances.pop(cls, None))
+        return cls(*args, **kwargs)
+
+    yield _create
+    for cls, instance in replaced.items():
+        if instance is None:
+            instances.pop(cls, None)
+        else:
+            instances[cls] = instance
+
+
 @pytest.fixture(scope="session")
 def logger() -> Logger:
     return get_logger(name="test")
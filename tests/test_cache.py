@@ -0,0 +1,33 @@
+from pathlib import Path
+
+from src.cache import CompletionCache, completion_cache_key
+
+_LLM_OUT = {"choices": [{"text": "Yes"}], "usage": {"prompt_tokens": 10, "completion_tokens": 1}}
+
+
+def test_completion_cache_key() -> None:
+    key = completion_cache_key(prompt="prompt", model_fingerprint="model", prompt_configs={"a": 1, "b": 2})
+    assert key == completion_cache_key(prompt="prompt", model_fingerprint="model", prompt_configs={"b": 2, "a": 1})
+    assert key != completion_cache_key(prompt="prompt", model_fingerprint="model", prompt_configs={"a": 2, "b": 2})
+    assert key != completion_cache_key(prompt="prompt", model_fingerprint="other", prompt_configs={"a": 1, "b": 2})
+
+
+def test_completion_cache_persist(tmp_path: Path) -> None:
+    cache_path = tmp_path / "cache.sqlite3"
+    cache = CompletionCache(path=cache_path, max_bytes=1 << 20)
+    assert cache.get(key="key") is None
+    cache.put(key="key", value=_LLM_OUT)
+    cache.close()
+
+    assert CompletionCache(path=cache_path, max_bytes=1 << 20).get(key="key") == _LLM_OUT
+
+
+def test_completion_cache_evict_least_recently_used(tmp_path: Path) -> None:
+    cache = CompletionCache(path=tmp_path / "cache.sqlite3", max_bytes=250)
+    cache.put(key="first", value=_LLM_OUT)
+    cache.put(key="second", value=_LLM_OUT)
+    cache.get(key="first")
+    cache.put(key="third", value=_LLM_OUT)
+    assert cache.get(key="second") is None, "Expected least recently used completion evicted"
+    assert cache.get(key="first") == _LLM_OUT
+    assert cache.get(key="third") == _LLM_OUT
@@ -1,6 +1,19 @@
+import io
 from uuid import uuid4
 
-from src.docs import DocumentChunk, parse_pdf_file
+from src.config import CONFIGS
+from src.docs import (
+    FALLBACK_ENCODING,
+    DocumentChunk,
+    detect_encoding,
+    get_text_splitter,
+    parse_pdf_file,
+    parse_pdf_file_batch,
+    parse_text_batch,
+    parse_text_stream,
+    split_text,
+    split_texts,
+)
 from tests import RESOURCE_DIR_PATH
 
 EXAMPLE_PDF_FILE = RESOURCE_DIR_PATH / "cobra_wiki.pdf"
@@ -13,3 +26,61 @@ def test_parse_pdf() -> None:
         len(chunks) == EXAMPLE_PDF_FILE_EXPECTED_CHUNK_COUNT
     ), f"Expected return {EXAMPLE_PDF_FILE_EXPECTED_CHUNK_COUNT} chunks"
     assert all(isinstance(chunk, DocumentChunk) and chunk.text for chunk in chunks)
+
+
+def test_split_texts_keep_order() -> None:
+    texts = [f"Sentence number {idx}. " * idx for idx in range(1, 40)]
+    assert split_texts(texts=texts, max_workers=4) == [split_text(text=text) for text in texts]
+
+
+def test_text_splitter_is_reused() -> None:
+    assert get_text_splitter() is get_text_splitter()
+
+
+def _page_span(chunk: DocumentChunk) -> tuple[int, int]:
+    start, end = chunk.metadata.page_start, chunk.metadata.page_end
+    assert start is not None and end is not None, "Expected page span to default to the chunk page"
+    return start, end
+
+
+def test_parse_pdf_document_chunking() -> None:
+    page_chunks = parse_pdf_file(stream=EXAMPLE_PDF_FILE, doc_id=str(uuid4()), chunking="page")
+    chunks = parse_pdf_file(stream=EXAMPLE_PDF_FILE, doc_id=str(uuid4()), chunking="document")
+    assert len(chunks) <= len(page_chunks), "Expected cross page chunking to not produce more chunks"
+    assert len({chunk.id for chunk in chunks}) == len(chunks), "Expected unique chunk ids"
+    spans = [_page_span(chunk=chunk) for chunk in chunks]
+    assert all(start <= end for start, end in spans)
+    assert spans[0][0] == 0
+    assert spans[-1][1] == max(_page_span(chunk=chunk)[1] for chunk in page_chunks)
+
+
+def test_chunk_batch_matches_document_chunks() -> None:
+    doc_id = str(uuid4())
+    batch = parse_pdf_file_batch(stream=EXAMPLE_PDF_FILE, doc_id=doc_id, chunking="document")
+    chunks = parse_pdf_file(stream=EXAMPLE_PDF_FILE, doc_id=doc_id, chunking="document")
+    assert batch.to_document_chunks() == chunks
+    assert batch.metadatas() == [chunk.metadata.model_dump() for chunk in chunks]
+
+
+def test_parse_text_stream_by_blocks() -> None:
+    text = " ".join(f"Sentence number {idx} is about cobras." for idx in range(200))
+    stream_batch = parse_text_stream(stream=io.BytesIO(text.encode()), doc_id="doc", block_size=100)
+    assert stream_batch.texts, "Expected chunks"
+    assert " ".join(stream_batch.texts).split() == text.split(), "Expected all the text in order"
+    capacity = CONFIGS.docs.chunk_capacity
+    max_length = capacity if isinstance(capacity, int) else capacity[1]
+    assert all(len(chunk_txt) <= max_length for chunk_txt in stream_batch.texts)
+    assert len(set(stream_batch.ids)) == len(stream_batch)
+
+    small_text = "Some Content"
+    small_batch = parse_text_stream(stream=io.BytesIO(small_text.encode()), doc_id="doc")
+    assert small_batch.texts == parse_text_batch(text=small_text, doc_id="doc").texts
+
+
+def test_detect_encoding() -> None:
+    text = "Café crème"
+    assert detect_encoding(sample=text.encode()) == "utf-8"
+    assert detect_encoding(sample=text.encode("utf-8")[:4]) == "utf-8", "Expected sample cut mid character"
+    assert detect_encoding(sample=text.encode("cp1252")) == FALLBACK_ENCODING
+    utf16_batch = parse_text_stream(stream=io.BytesIO(text.encode("utf-16")), doc_id="doc")
+    assert utf16_batch.texts == [text]
@@ -0,0 +1,92 @@
+import threading
+from itertools import islice
+from pathlib import Path
+
+import pytest
+
+from src.config import CONFIGS
+from src.evaluation import EvaluationCase, EvaluationRunner
+from src.llm import LLMOutput
+from src.prompts import EvaluationPrompt, Prompt, QAPrompt
+
+
+class _FakeLLMService:
+    def __init__(self) -> None:
+        self.cfg = CONFIGS.llm
+        self.qa_prompt = QAPrompt()
+        self.calls = 0
+
+    def generate_answer(self, question: str, sources: list[str]) -> LLMOutput:
+        self.calls += 1
+        return LLMOutput(text=sources[0], prompt_tokens=10, completion_tokens=2)
+
+    def generate(self, prompt: Prompt, prompt_inputs: dict) -> LLMOutput:
+        self.calls += 1
+        correct = (
+            prompt_inputs[EvaluationPrompt.INPUT_ANSWER_KEY]
+            == prompt_inputs[EvaluationPrompt.INPUT_REFERENCE_ANSWER_KEY]
+        )
+        return LLMOutput(text="CORRECT" if correct else "INCORRECT", prompt_tokens=20, completion_tokens=1)
+
+
+@pytest.fixture
+def eval_cases() -> list[EvaluationCase]:
+    return [
+        EvaluationCase(id=str(idx), question=f"Question {idx}", sources=[f"Answer {idx}"], reference=f"Answer {idx}")
+        for idx in range(5)
+    ] + [EvaluationCase(id="wrong", question="Question", sources=["Answer"], reference="Another answer")]
+
+
+def test_evaluation_runner_report(eval_cases: list[EvaluationCase]) -> None:
+    runner = EvaluationRunner(llm_service=_FakeLLMService(), batch_size=2)  # type: ignore
+    results, report = runner.run(cases=eval_cases)
+    assert [res.case_id for res in results] == [case.id for case in eval_cases], "Expected results in case order"
+    assert report.count == len(eval_cases)
+    assert report.accuracy == 5 / 6
+    assert report.completion_tokens == 3 * len(eval_cases)
+
+
+def test_evaluation_runner_resume_from_checkpoint(eval_cases: list[EvaluationCase], tmp_path: Path) -> None:
+    checkpoint_path = tmp_path / "checkpoint.jsonl"
+    interrupted_runner = EvaluationRunner(llm_service=_FakeLLMService(), checkpoint_path=checkpoint_path)  # type: ignore
+    interrupted_count = 3
+    assert len(list(islice(interrupted_runner.iter_results(cases=eval_cases), interrupted_count))) == interrupted_count
+
+    llm_service = _FakeLLMService()
+    runner = EvaluationRunner(llm_service=llm_service, checkpoint_path=checkpoint_path)  # type: ignore
+    _, report = runner.run(cases=eval_cases)
+    assert report.count == len(eval_cases)
+    assert llm_service.calls == 2 * (len(eval_cases) - interrupted_count), "Expected checkpointed cases not rerun"
+
+
+def test_evaluation_runner_rerun_edited_cases(
+    eval_cases: list[EvaluationCase], tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    checkpoint_path = tmp_path / "checkpoint.jsonl"
+    EvaluationRunner(llm_service=_FakeLLMService(), checkpoint_path=checkpoint_path).run(cases=eval_cases)  # type: ignore
+
+    edited_count = 1
+    edited_cases = [eval_cases[0].model_copy(update={"reference": "Edited answer"}), *eval_cases[edited_count:]]
+    llm_service = _FakeLLMService()
+    results, _ = EvaluationRunner(llm_service=llm_service, checkpoint_path=checkpoint_path).run(  # type: ignore
+        cases=edited_cases
+    )
+    assert llm_service.calls == 2 * edited_count, "Expected only the edited case rerun"
+    assert not results[0].correct
+
+    monkeypatch.setattr(EvaluationPrompt, "template", EvaluationPrompt.template + "\n")
+    llm_service = _FakeLLMService()
+    EvaluationRunner(llm_service=llm_service, checkpoint_path=checkpoint_path).run(cases=edited_cases)  # type: ignore
+    assert llm_service.calls == 2 * len(eval_cases), "Expected every case rerun with another evaluation prompt"
+
+
+def test_evaluation_runner_stops_answering_when_closed(eval_cases: list[EvaluationCase]) -> None:
+    llm_service = _FakeLLMService()
+    runner = EvaluationRunner(llm_service=llm_service, batch_size=1)  # type: ignore
+    thread_count = threading.active_count()
+    results = runner.iter_results(cases=eval_cases)
+    next(results)
+    results.close()
+    assert threading.active_count() == thread_count, "Expected answer thread stopped once the results are closed"
+    assert not runner._answer_lock.locked()
+    assert llm_service.calls < 2 * len(eval_cases), "Expected remaining cases not answered"
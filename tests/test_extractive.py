@@ -0,0 +1,25 @@
+from src.extractive import ExtractiveAnswerer
+
+SOURCES = [
+    "The king cobra is a venomous snake. The king cobra lives in the forests of India and Southeast Asia.",
+    "Cobras are elapid snakes.",
+]
+
+
+def test_extract_answer_sentence() -> None:
+    extracted = ExtractiveAnswerer().extract(question="Where does the king cobra live?", sources=SOURCES)
+    assert extracted is not None
+    assert extracted.text == "The king cobra lives in the forests of India and Southeast Asia."
+
+
+def test_extract_skip_yes_no_question() -> None:
+    assert ExtractiveAnswerer().extract(question="Is the king cobra venomous?", sources=SOURCES) is None
+
+
+def test_answer_fallback_when_not_confident() -> None:
+    answerer = ExtractiveAnswerer()
+    question_count, fast_path_count = answerer.question_count, answerer.fast_path_count
+    assert answerer.answer(question="What does the king cobra eat?", sources=SOURCES) is None
+    assert answerer.answer(question="Where does the king cobra live?", sources=SOURCES) is not None
+    assert answerer.question_count == question_count + 2
+    assert answerer.fast_path_count == fast_path_count + 1
@@ -0,0 +1,123 @@
+from pathlib import Path
+from uuid import uuid4
+
+import numpy as np
+import pytest
+
+from src.config import CONFIGS
+from src.docs import ChunkBatch
+from src.quantization import QuantizationMode, QuantizedIndex
+from src.vector_store import VectorStore
+from tests import SingletonFactory
+
+DIM = 32
+MIN_RECALL = 0.8
+
+
+def _random_vectors(count: int, seed: int = 0) -> np.ndarray:
+    vectors = np.random.default_rng(seed).normal(size=(count, DIM)).astype(np.float32)
+    normalized: np.ndarray = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+    return normalized
+
+
+@pytest.mark.parametrize("mode", ["int8", "binary"])
+def test_quantized_search_rescored_distances(tmp_path: Path, mode: QuantizationMode) -> None:
+    vectors = _random_vectors(count=500)
+    ids = [f"c{idx}" for idx in range(len(vectors))]
+    index = QuantizedIndex(dir_path=tmp_path, mode=mode)
+    index.add(ids=ids, vectors=vectors)
+
+    query = _random_vectors(count=1, seed=1)[0]
+    hits = index.search(query=query, k=10, rescore_k=100)
+    exact_distances = ((vectors - query) ** 2).sum(axis=1)
+    for c_id, distance in hits:
+        assert distance == pytest.approx(exact_distances[ids.index(c_id)], abs=1e-5), "Expected exact distances"
+    assert [distance for _, distance in hits] == sorted(distance for _, distance in hits)
+    assert index.measure_recall(query=query, hits=hits, k=10) >= MIN_RECALL
+    assert index.memory_report()["code_bytes"] < index.memory_report()["full_precision_bytes"]
+
+
+def test_quantized_index_delete_compact_reload(tmp_path: Path) -> None:
+    vectors = _random_vectors(count=20)
+    index = QuantizedIndex(dir_path=tmp_path, mode="int8")
+    index.add(ids=[f"c{idx}" for idx in range(20)], vectors=vectors)
+    assert index.delete(ids=["c0", "c1"]) == 2  # noqa: PLR2004
+    index.add(ids=["c2"], vectors=vectors[3:4])  # replace c2 vector
+    assert "c0" not in {c_id for c_id, _ in index.search(query=vectors[0], k=20, rescore_k=20)}
+
+    reloaded = QuantizedIndex(dir_path=tmp_path, mode="int8")
+    assert len(reloaded) == len(index) == 18  # noqa: PLR2004
+    np.testing.assert_array_equal(reloaded.get_vectors(ids=["c2"]), vectors[3:4])
+
+    reloaded.compact()
+    assert reloaded.row_count == len(reloaded) == 18  # noqa: PLR2004
+    np.testing.assert_array_equal(reloaded.get_vectors(ids=["c2", "c19"]), vectors[[3, 19]])
+    assert reloaded.search(query=vectors[19], k=1, rescore_k=5)[0][0] == "c19"
+
+
+@pytest.fixture
+def quantized_vector_store(
+    vector_store: VectorStore, fresh_singleton: SingletonFactory, monkeypatch: pytest.MonkeyPatch
+) -> VectorStore:
+    monkeypatch.setattr(CONFIGS.chromadb, "quantization", "int8")
+    return fresh_singleton(VectorStore, chromadb_in_memory=True)
+
+
+def _example_batch(doc_id: str) -> ChunkBatch:
+    batch = ChunkBatch(document_id=doc_id)
+    for idx, text in enumerate(
+        [
+            "The king cobra is a venomous snake.",
+            "The king cobra lives in the forests of India.",
+            "Python is a programming language.",
+        ]
+    ):
+        batch.append(chunk_id=f"{doc_id}_{idx}", text=text, page_start=1)
+    return batch
+
+
+def test_quantized_search_keeps_distances(vector_store: VectorStore, quantized_vector_store: VectorStore) -> None:
+    doc_id = str(uuid4())
+    collections = []
+    for store in (vector_store, quantized_vector_store):
+        collection = str(uuid4())
+        collections.append(collection)
+        store.get_or_create_collection(name=collection)
+        store.add_multiple_document_chunks(chunks=_example_batch(doc_id=doc_id), collection_name=collection)
+    try:
+        query = "Where does the king cobra live?"
+        exp = vector_store.search_batch(query=query, collection_name=collections[0], rerank=False)
+        res = quantized_vector_store.search_batch(query=query, collection_name=collections[1], rerank=False)
+        assert res.ids == exp.ids
+        assert res.distances == pytest.approx(exp.distances, abs=1e-4), "Expected same distances as chroma"
+        assert res.texts == exp.texts
+
+        assert not quantized_vector_store.search_batch(
+            query=query, collection_name=collections[1], document_ids=["unknown"]
+        ), "Expected document filter"
+        quantized_vector_store.delete_document(document_id=doc_id, collection_name=collections[1])
+        assert not quantized_vector_store.search_batch(query=query, collection_name=collections[1])
+    finally:
+        quantized_vector_store.wait_compactions()  # deleting every chunk compacts in background
+        for collection in collections:
+            vector_store.chromadb_client.delete_collection(name=collection)
+
+
+def test_quantized_index_rebuilt_from_chroma(
+    quantized_vector_store: VectorStore, fresh_singleton: SingletonFactory
+) -> None:
+    collection = str(uuid4())
+    quantized_vector_store.get_or_create_collection(name=collection)
+    quantized_vector_store.add_multiple_document_chunks(chunks=_example_batch(doc_id="doc"), collection_name=collection)
+    try:
+        query = "Where does the king cobra live?"
+        exp = quantized_vector_store.search_batch(query=query, collection_name=collection, rerank=False)
+        replica = fresh_singleton(VectorStore, chromadb_in_memory=True)  # another process, with its own empty index
+        res = replica.search_batch(query=query, collection_name=collection, rerank=False)
+        assert res.ids == exp.ids
+        assert res.distances == pytest.approx(exp.distances, abs=1e-4)
+        report = replica.quantization_report()
+        assert report is not None
+        assert report["collections"][collection]["live_rows"] == len(_example_batch(doc_id="doc"))
+    finally:
+        quantized_vector_store.chromadb_client.delete_collection(name=collection)
@@ -0,0 +1,53 @@
+from src.rerank import MMRReranker
+
+
+def test_mmr_rerank_prefers_diverse_chunks() -> None:
+    reranker = MMRReranker(mmr_lambda=0.5)
+    ids = ["a", "a_duplicate", "b"]
+    distances = [0.1, 0.1, 0.3]
+    embeddings = [[1.0, 0.0], [1.0, 0.0], [0.6, 0.8]]
+    ranked = reranker.rerank(
+        query="q", ids=ids, content_hashes=ids, distances=distances, embeddings=embeddings, top_k=2
+    )
+    assert [ids[idx] for idx in ranked] == ["a", "b"], "Expected duplicated chunk to be ranked out"
+
+
+def test_mmr_rerank_relevance_only() -> None:
+    reranker = MMRReranker(mmr_lambda=1)
+    ranked = reranker.rerank(
+        query="q",
+        ids=["a", "b", "c"],
+        content_hashes=["a", "b", "c"],
+        distances=[0.5, 0.1, 0.3],
+        embeddings=[[1, 0], [1, 0], [1, 0]],
+        top_k=3,
+    )
+    assert ranked == [1, 2, 0], "Expected chunks ranked by distance"
+
+
+def test_rerank_cache() -> None:
+    reranker = MMRReranker(cache_size=1)
+    kwargs = {
+        "ids": ["a", "b"],
+        "content_hashes": ["a", "b"],
+        "distances": [0.1, 0.2],
+        "embeddings": [[1, 0], [0, 1]],
+        "top_k": 1,
+    }
+    first = reranker.rerank(query="q", **kwargs)  # type: ignore
+    assert reranker.rerank(query="q", **kwargs) is first  # type: ignore
+    reranker.rerank(query="other", **kwargs)  # type: ignore
+    assert len(reranker._cache) == 1, "Expected cache to be bounded"
+
+
+def test_rerank_cache_not_reused_for_rewritten_chunk() -> None:
+    reranker = MMRReranker(mmr_lambda=1)
+    ids = ["a", "b"]
+    embeddings = [[1, 0], [0, 1]]
+    assert reranker.rerank(
+        query="q", ids=ids, content_hashes=["a1", "b1"], distances=[0.1, 0.2], embeddings=embeddings, top_k=1
+    ) == [0]
+    ranked = reranker.rerank(
+        query="q", ids=ids, content_hashes=["a2", "b1"], distances=[0.3, 0.2], embeddings=embeddings, top_k=1
+    )
+    assert ranked == [1], "Expected chunk rewritten under the same id to be reranked"
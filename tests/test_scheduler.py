@@ -0,0 +1,81 @@
+import asyncio
+
+import pytest
+from pydantic import ValidationError
+
+from src.config import CONFIGS, TenancyConfig
+from src.scheduler import DeadlineExceededError, FairScheduler, OverloadedError, TenantQueueFullError
+from tests import SingletonFactory
+
+
+@pytest.fixture
+def scheduler(fresh_singleton: SingletonFactory) -> FairScheduler:
+    return fresh_singleton(FairScheduler)
+
+
+def test_scheduler_round_robin_between_tenants(scheduler: FairScheduler) -> None:
+    order = []
+
+    async def _run(tenant: str) -> None:
+        async with scheduler.slot(tenant=tenant):
+            order.append(tenant)
+            await asyncio.sleep(0)
+
+    async def _main() -> None:
+        await asyncio.gather(*[_run(tenant="heavy") for _ in range(4)], _run(tenant="light"))
+
+    asyncio.run(_main())
+    assert order.index("light") <= 1, f"Expected light tenant not to wait for all heavy requests. Got: {order}"
+
+
+def test_scheduler_reject_when_tenant_queue_full(scheduler: FairScheduler) -> None:
+    scheduler.cfg = scheduler.cfg.model_copy(update={"max_pending_requests": 1})
+
+    async def _run() -> None:
+        async with scheduler.slot(tenant="tenant"):
+            await asyncio.sleep(0.01)
+
+    async def _main() -> list[BaseException | None]:
+        return list(await asyncio.gather(_run(), _run(), _run(), return_exceptions=True))
+
+    results = asyncio.run(_main())
+    assert any(isinstance(res, TenantQueueFullError) for res in results), "Expected request exceeding queue rejected"
+
+
+def test_scheduler_reject_when_estimated_wait_exceeds_deadline(scheduler: FairScheduler) -> None:
+    async def _run(deadline: float | None, request_seconds: float | None = None) -> None:
+        async with scheduler.slot(tenant="tenant", deadline=deadline, request_seconds=request_seconds):
+            await asyncio.sleep(0.05)
+
+    async def _main() -> None:
+        running = asyncio.ensure_future(_run(deadline=None))
+        await asyncio.sleep(0)
+        now = asyncio.get_running_loop().time()
+        with pytest.raises(OverloadedError):
+            await _run(deadline=now + 1, request_seconds=10)
+        await _run(deadline=now + 1, request_seconds=0.01)  # short wait, queued
+        await running
+
+    asyncio.run(_main())
+    assert scheduler.overloaded_count == 1
+
+
+def test_scheduler_deadline_exceeded_while_queued(scheduler: FairScheduler) -> None:
+    async def _main() -> None:
+        loop = asyncio.get_running_loop()
+        async with scheduler.slot(tenant="tenant"):
+            with pytest.raises(DeadlineExceededError):
+                async with scheduler.slot(tenant="other", deadline=loop.time() + 0.01):
+                    pass
+            assert scheduler.queued_count == 1, "Expected timed out request removed from the queue"
+        async with scheduler.slot(tenant="other", deadline=loop.time() + 1):
+            assert scheduler.queued_count == 1, "Expected slot granted after the timed out request"
+
+    asyncio.run(_main())
+    assert scheduler.deadline_exceeded_count == 1
+    assert scheduler.pending_count(tenant="other") == 0
+
+
+def test_multiple_llm_slots_rejected() -> None:
+    with pytest.raises(ValidationError):
+        TenancyConfig.model_validate(CONFIGS.tenancy.model_dump() | {"llm_slots": 2})
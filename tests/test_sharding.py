@@ -0,0 +1,86 @@
+from uuid import uuid4
+
+import pytest
+
+from src.config import CONFIGS
+from src.docs import ChunkBatch
+from src.vector_store import VectorStore
+from tests import SingletonFactory
+
+SHARD_COUNT = 3
+TEXTS = [
+    "The king cobra is a venomous snake.",
+    "The king cobra lives in the forests of India.",
+    "Python is a programming language.",
+    "The mongoose hunts snakes.",
+    "Rice is grown in flooded fields.",
+    "The Ganges flows through India.",
+]
+
+
+@pytest.fixture
+def sharded_vector_store(
+    vector_store: VectorStore, fresh_singleton: SingletonFactory, monkeypatch: pytest.MonkeyPatch
+) -> VectorStore:
+    monkeypatch.setattr(CONFIGS.chromadb, "shards", [{}] * SHARD_COUNT)
+    return fresh_singleton(VectorStore, chromadb_in_memory=True)
+
+
+def _document_batches() -> list[ChunkBatch]:
+    batches = []
+    for idx, text in enumerate(TEXTS):
+        batch = ChunkBatch(document_id=f"doc{idx}")
+        batch.append(chunk_id=f"doc{idx}_0", text=text, page_start=1)
+        batches.append(batch)
+    return batches
+
+
+def test_sharded_search_same_as_single_store(vector_store: VectorStore, sharded_vector_store: VectorStore) -> None:
+    collections = [str(uuid4()), str(uuid4())]
+    stores = (vector_store, sharded_vector_store)
+    for store, collection in zip(stores, collections, strict=True):
+        store.get_or_create_collection(name=collection)
+        for batch in _document_batches():
+            store.add_multiple_document_chunks(chunks=batch, collection_name=collection)
+    try:
+        for shard, client in enumerate(sharded_vector_store.clients):
+            metadatas = client.get_collection(name=collections[1]).get()["metadatas"] or []
+            doc_ids = {str(meta["document_id"]) for meta in metadatas}
+            assert doc_ids, "Expected documents spread over all shards"
+            assert all(sharded_vector_store.shard_of(document_id=doc_id) == shard for doc_id in doc_ids)
+        assert sharded_vector_store.count(collection_name=collections[1]) == len(TEXTS)
+
+        query = "Where does the king cobra live?"
+        exp = vector_store.search_batch(query=query, n_results=4, collection_name=collections[0], rerank=False)
+        res = sharded_vector_store.search_batch(query=query, n_results=4, collection_name=collections[1], rerank=False)
+        assert res.ids == exp.ids, "Expected merged shard results to be the closest chunks"
+        assert res.distances == pytest.approx(exp.distances)
+    finally:
+        for store, collection in zip(stores, collections, strict=True):
+            for client in store.clients:
+                client.delete_collection(name=collection)
+
+
+def test_sharded_document_query_routed_to_owner(
+    sharded_vector_store: VectorStore, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    collection = str(uuid4())
+    sharded_vector_store.get_or_create_collection(name=collection)
+    sharded_vector_store.add_multiple_document_chunks(
+        chunks=[chunk for batch in _document_batches() for chunk in batch.to_document_chunks()],
+        collection_name=collection,
+    )
+    queried_shards = []
+    get_collection = sharded_vector_store.get_collection
+
+    def _get_collection(name: str, shard: int = 0) -> object:
+        queried_shards.append(shard)
+        return get_collection(name=name, shard=shard)
+
+    monkeypatch.setattr(sharded_vector_store, "get_collection", _get_collection)
+    res = sharded_vector_store.search_batch(query=TEXTS[3], collection_name=collection, document_ids=["doc3"])
+    assert res.ids == ["doc3_0"]
+    assert queried_shards == [sharded_vector_store.shard_of(document_id="doc3")]
+
+    assert sharded_vector_store.delete_document(document_id="doc3", collection_name=collection) == 1
+    assert sharded_vector_store.count(collection_name=collection) == len(TEXTS) - 1
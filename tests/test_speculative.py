@@ -0,0 +1,103 @@
+import numpy as np
+import pytest
+
+from src.speculative import PromptLookupDrafter, SpeculativeDecoder
+
+_EOS = 256
+
+
+class _CopyingLlama:
+    """Byte level fake model, greedily continues with the bytes that followed the first occurrence of the last byte"""
+
+    def __init__(self, n_ctx: int = 512) -> None:
+        self._n_ctx = n_ctx
+        self.input_ids = np.zeros(n_ctx, dtype=np.intc)
+        self.scores = np.zeros((n_ctx, _EOS + 1), dtype=np.single)
+        self.n_tokens = 0
+        self.eval_calls = 0
+
+    def n_ctx(self) -> int:
+        return self._n_ctx
+
+    def token_eos(self) -> int:
+        return _EOS
+
+    def tokenize(self, text: bytes) -> list[int]:
+        return list(text)
+
+    def detokenize(self, tokens: list[int]) -> bytes:
+        return bytes(tokens)
+
+    def reset(self) -> None:
+        self.n_tokens = 0
+
+    def eval(self, tokens: list[int]) -> None:
+        self.eval_calls += 1
+        for token in tokens:
+            self.input_ids[self.n_tokens] = token
+            history = self.input_ids[: self.n_tokens + 1].tolist()
+            first = history.index(token)
+            next_token = history[first + 1] if first + 1 < len(history) - 1 else _EOS
+            self.scores[self.n_tokens] = 0
+            self.scores[self.n_tokens, next_token] = 1
+            self.n_tokens += 1
+
+    def sample(self, **kwargs: float) -> int:
+        return int(np.argmax(self.scores[self.n_tokens - 1]))
+
+
+def _greedy_generate(llm: _CopyingLlama, prompt: str, max_tokens: int) -> str:
+    llm.reset()
+    llm.eval(llm.tokenize(prompt.encode()))
+    generated: list[int] = []
+    while len(generated) < max_tokens:
+        token = llm.sample()
+        if token == _EOS:
+            break
+        generated.append(token)
+        llm.eval([token])
+    return llm.detokenize(generated).decode()
+
+
+def test_prompt_lookup_drafter() -> None:
+    drafter = PromptLookupDrafter(max_ngram_size=2)
+    assert drafter.draft(tokens=[1, 2, 3, 4, 1, 2], num_tokens=2) == [3, 4]
+    assert drafter.draft(tokens=[1, 2, 3], num_tokens=2) == [], "Expected no draft without earlier n-gram"
+
+
+@pytest.mark.parametrize("max_tokens", [1, 7, 64])
+def test_speculative_decoding_same_as_normal_decoding(max_tokens: int) -> None:
+    prompt = "Q: abcdefghijklmnopqrstuvwxyz. A: abc"
+    exp_text = _greedy_generate(llm=_CopyingLlama(), prompt=prompt, max_tokens=max_tokens)
+
+    llm = _CopyingLlama()
+    decoder = SpeculativeDecoder(llm=llm, drafter=PromptLookupDrafter(), num_draft_tokens=8)  # type: ignore
+    out = decoder.create_completion(prompt=prompt, max_tokens=max_tokens, temperature=0)
+    assert out["choices"][0]["text"] == exp_text
+    assert out["usage"]["completion_tokens"] == len(exp_text)
+    min_acceptance_rate = 0.5
+    if max_tokens > 1:
+        assert (
+            decoder.acceptance_rate > min_acceptance_rate
+        ), "Expected copied answer to be mostly drafted from the prompt"
+        assert llm.eval_calls < len(exp_text), "Expected fewer evaluations than generated tokens"
+
+
+def test_speculative_decoding_stop_sequence() -> None:
+    decoder = SpeculativeDecoder(llm=_CopyingLlama(), drafter=PromptLookupDrafter(), num_draft_tokens=8)  # type: ignore
+    out = decoder.create_completion(prompt="abcdefgh a", max_tokens=64, stop="e")
+    assert out["choices"][0]["text"] == "bcd"
+    assert out["choices"][0]["finish_reason"] == "stop"
+
+
+def test_speculative_decoding_aborted_by_should_stop() -> None:
+    decoder = SpeculativeDecoder(llm=_CopyingLlama(), drafter=PromptLookupDrafter(), num_draft_tokens=1)  # type: ignore
+    steps = []
+
+    def _should_stop() -> bool:
+        steps.append(1)
+        return len(steps) > 2  # noqa: PLR2004
+
+    out = decoder.create_completion(prompt="abcdefgh a", max_tokens=64, should_stop=_should_stop)
+    assert out["choices"][0]["finish_reason"] == "stop"
+    assert out["usage"]["completion_tokens"] <= 4, "Expected generation stopped after 2 steps"  # noqa: PLR2004
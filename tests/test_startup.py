@@ -0,0 +1,95 @@
+import json
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+from src.startup import Preloader, PreloadStatus
+from tests import TEST_DIR_PATH, SingletonFactory
+
+IMPORT_TIME_BUDGET_SEC = 3.0
+HEAVY_MODULES = ("chromadb", "llama_cpp", "pypdf", "semantic_text_splitter", "numpy")
+
+
+@pytest.fixture
+def preloader(fresh_singleton: SingletonFactory) -> Preloader:
+    return fresh_singleton(Preloader)
+
+
+def test_app_import_is_lazy() -> None:
+    script = (
+        "import json, sys, time\n"
+        "start = time.perf_counter()\n"
+        "import src.app\n"
+        "elapsed = time.perf_counter() - start\n"
+        f"print(json.dumps({{'time': elapsed, 'heavy': [m for m in {HEAVY_MODULES} if m in sys.modules]}}))"
+    )
+    out = subprocess.run(  # noqa: S603
+        [sys.executable, "-c", script], cwd=TEST_DIR_PATH.parent, capture_output=True, text=True, check=True
+    )
+    res = json.loads(out.stdout.strip().splitlines()[-1])
+    assert not res["heavy"], f"Expected heavy modules to be imported on first use. Got: {res['heavy']}"
+    assert res["time"] < IMPORT_TIME_BUDGET_SEC, f"Expected import under {IMPORT_TIME_BUDGET_SEC}s. Got: {res['time']}"
+
+
+def _wait_status(preloader: Preloader, status: PreloadStatus, timeout: float = 5) -> bool:
+    deadline = time.monotonic() + timeout
+    while preloader.status != status:
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+def test_preloader_ready_after_loading(preloader: Preloader) -> None:
+    release = threading.Event()
+    loaded = []
+    preloader.start(loaders={"slow": lambda: release.wait(timeout=5), "fast": lambda: loaded.append("fast")})
+    assert preloader.status == "LOADING"
+    assert not preloader.wait(timeout=0.01)
+    release.set()
+    assert preloader.wait(timeout=5)
+    assert _wait_status(preloader=preloader, status="READY", timeout=0)
+    assert loaded == ["fast"]
+    assert list(preloader.load_times) == ["slow", "fast"]
+
+
+def test_preloader_failed(preloader: Preloader, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(preloader.cfg, "retry_interval", 0)
+    loaded = []
+
+    def _fail() -> None:
+        raise RuntimeError("no model")
+
+    preloader.start(loaders={"llm": _fail, "vector_store": lambda: loaded.append("vector_store")})
+    assert preloader.wait(timeout=5)
+    assert preloader.status == "FAILED"
+    assert preloader.error and "llm" in preloader.error
+    assert loaded == ["vector_store"], "Expected the other subsystems loaded after a failure"
+
+
+def test_preloader_ready_after_retry(preloader: Preloader, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(preloader.cfg, "retry_interval", 0.01)
+    retried = threading.Event()
+    release = threading.Event()
+
+    def _fail_once() -> None:
+        if not retried.is_set():
+            retried.set()
+            raise RuntimeError("vector store unavailable")
+        release.wait(timeout=5)
+
+    preloader.start(loaders={"vector_store": _fail_once})
+    assert preloader.wait(timeout=5)
+    assert preloader.status == "FAILED"
+    release.set()
+    assert _wait_status(preloader=preloader, status="READY"), "Expected ready once the failed subsystem is reloaded"
+    assert preloader.error is None
+    assert "vector_store" in preloader.load_times
+
+
+def test_preloader_ready_without_preloading(preloader: Preloader) -> None:
+    assert preloader.status == "READY"
+    assert preloader.wait()
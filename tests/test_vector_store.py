@@ -1,10 +1,16 @@
+import threading
+import time
 from collections.abc import Callable, Iterator
 from pathlib import Path
+from typing import Any
 from uuid import uuid4
 
 import pytest
+from chromadb.api.segment import SegmentAPI
 
-from src.vector_store import VectorStore
+from src.docs import DocumentChunk, DocumentChunkMetadata
+from src.vector_store import VectorStore, VectorStoreError
+from tests import SingletonFactory
 
 from .data import load_hotpot_qa_test_cases
 
@@ -70,3 +76,211 @@ def test_document_retrieval(
     avg_f1_score = sum(f1_scores) / len(f1_scores)
     min_f1_score = 0.35
     assert avg_f1_score > min_f1_score, f"Expected avg f1 score to be above {min_f1_score}"
+
+
+def test_update_document_shifted_chunks_keep_embeddings(
+    vector_store: VectorStore, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setattr(vector_store, "batch_size", 2)
+    doc_id = str(uuid4())
+    texts = [f"Chunk number {idx} about snakes" for idx in range(6)]
+
+    def _chunks(chunk_texts: list[str]) -> list[DocumentChunk]:
+        return [
+            DocumentChunk(id=f"{doc_id}_{idx}", text=text, metadata=DocumentChunkMetadata(page=0, document_id=doc_id))
+            for idx, text in enumerate(chunk_texts)
+        ]
+
+    vector_store.add_multiple_document_chunks(chunks=_chunks(texts))
+    try:
+        collection = vector_store.default_collection
+        where = {"document_id": {"$eq": doc_id}}
+        old = collection.get(where=where, include=["embeddings", "documents"])  # type: ignore
+        old_embeddings = dict(zip(old["documents"], old["embeddings"], strict=True))  # type: ignore
+        # new chunk at the start shifts every chunk id across the batch boundaries
+        res = vector_store.update_document_chunks(document_id=doc_id, chunks=_chunks(["A new first chunk", *texts]))
+        assert res.embedded == 1
+        stored = collection.get(where=where, include=["embeddings", "documents"])  # type: ignore
+        for text, embedding in zip(stored["documents"], stored["embeddings"], strict=True):  # type: ignore
+            if text in old_embeddings:
+                assert embedding == pytest.approx(old_embeddings[text]), f"Expected copied embedding of '{text}'"
+    finally:
+        vector_store.delete_document(document_id=doc_id)
+
+
+def test_add_chunks_over_chroma_max_batch_size(vector_store: VectorStore, monkeypatch: pytest.MonkeyPatch) -> None:
+    max_batch_size = 5
+    monkeypatch.setattr(SegmentAPI, "max_batch_size", property(lambda _: max_batch_size))
+    monkeypatch.setattr(vector_store, "batch_size", max_batch_size - 1)
+    doc_id = str(uuid4())
+    chunk_count = 3 * max_batch_size
+    vector_store.add_multiple_document_chunks(
+        chunks=[
+            DocumentChunk(
+                id=f"{doc_id}_{idx}", text=f"Chunk {idx}", metadata=DocumentChunkMetadata(page=0, document_id=doc_id)
+            )
+            for idx in range(chunk_count)
+        ]
+    )
+    assert len(vector_store.get_chunk_by_document_id(document_id=doc_id)) == chunk_count
+    vector_store.delete_document(document_id=doc_id)
+
+
+COMPACTION_CHUNK_COUNT = 6
+
+
+@pytest.fixture
+def compaction_collection(vector_store: VectorStore) -> Iterator[str]:
+    name = str(uuid4())
+    vector_store.get_or_create_collection(name=name)
+    vector_store.add_multiple_document_chunks(
+        chunks=[
+            DocumentChunk(
+                id=f"{doc}_{idx}", text=f"{doc} chunk {idx}", metadata=DocumentChunkMetadata(page=0, document_id=doc)
+            )
+            for doc in ("kept", "deleted")
+            for idx in range(COMPACTION_CHUNK_COUNT // 2)
+        ],
+        collection_name=name,
+    )
+    yield name
+    vector_store.wait_compactions()
+    vector_store.chromadb_client.delete_collection(name=name)
+
+
+def _temporary_collections(vector_store: VectorStore, name: str) -> set[str]:
+    names = {collection.name for collection in vector_store.chromadb_client.list_collections()}
+    return names & {f"{name}{VectorStore.COMPACTING_SUFFIX}", f"{name}{VectorStore.REPLACED_SUFFIX}"}
+
+
+def test_compaction_in_background_keeps_concurrent_writes(
+    vector_store: VectorStore, compaction_collection: str, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    copy_rows = vector_store._copy_rows
+    new_chunk = DocumentChunk(id="new_0", text="new chunk", metadata=DocumentChunkMetadata(page=0, document_id="new"))
+
+    def _copy_rows_with_concurrent_writes(**kwargs: Any) -> None:
+        copy_rows(**kwargs)
+        if "new_0" not in vector_store.get_collection(name=compaction_collection).get(ids=["new_0"])["ids"]:
+            vector_store.add_multiple_document_chunks(chunks=[new_chunk], collection_name=compaction_collection)
+            vector_store.delete_document(document_id="kept", collection_name=compaction_collection)
+
+    monkeypatch.setattr(vector_store, "_copy_rows", _copy_rows_with_concurrent_writes)
+    old_id = vector_store.get_collection(name=compaction_collection).id
+    vector_store.delete_document(document_id="deleted", collection_name=compaction_collection)
+    vector_store.wait_compactions()
+
+    collection = vector_store.get_collection(name=compaction_collection)
+    assert collection.id != old_id, "Expected collection rebuilt after deleting half of its chunks"
+    assert collection.get()["ids"] == ["new_0"], "Expected writes done during compaction in the rebuilt collection"
+    assert not _temporary_collections(vector_store=vector_store, name=compaction_collection)
+
+
+@pytest.mark.parametrize("with_copy", [True, False])
+def test_compaction_recovered_after_crash_between_renames(
+    vector_store: VectorStore, compaction_collection: str, with_copy: bool
+) -> None:
+    client = vector_store.chromadb_client
+    if with_copy:
+        copy = client.create_collection(name=f"{compaction_collection}{VectorStore.COMPACTING_SUFFIX}")
+        vector_store._copy_rows(
+            rows=client.get_collection(name=compaction_collection).get(
+                include=["embeddings", "metadatas", "documents"]
+            ),
+            target=copy,
+        )
+    client.get_collection(name=compaction_collection).modify(
+        name=f"{compaction_collection}{VectorStore.REPLACED_SUFFIX}"
+    )
+
+    vector_store.get_or_create_collection(name=compaction_collection)
+    assert vector_store.count(collection_name=compaction_collection) == COMPACTION_CHUNK_COUNT
+    assert not _temporary_collections(vector_store=vector_store, name=compaction_collection)
+
+
+def test_compaction_drops_stale_copy(vector_store: VectorStore, compaction_collection: str) -> None:
+    vector_store.chromadb_client.create_collection(name=f"{compaction_collection}{VectorStore.COMPACTING_SUFFIX}")
+    vector_store.compact_collection(name=compaction_collection)
+    assert vector_store.count(collection_name=compaction_collection) == COMPACTION_CHUNK_COUNT
+    assert not _temporary_collections(vector_store=vector_store, name=compaction_collection)
+
+
+def test_compaction_keeps_writes_of_another_process(
+    vector_store: VectorStore,
+    compaction_collection: str,
+    fresh_singleton: SingletonFactory,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    other_store = fresh_singleton(VectorStore, chromadb_in_memory=True)  # shares chroma, not the store lock
+    copy_rows, sync_copy = vector_store._copy_rows, vector_store._sync_copy
+    copy_chunk, swap_chunk = (
+        DocumentChunk(id=f"{doc}_0", text=f"{doc} chunk", metadata=DocumentChunkMetadata(page=0, document_id=doc))
+        for doc in ("copy", "swap")
+    )
+    swap_writer = threading.Thread(
+        target=other_store.add_multiple_document_chunks,
+        kwargs={"chunks": [swap_chunk], "collection_name": compaction_collection},
+    )
+
+    def _copy_rows_with_other_writes(**kwargs: Any) -> None:
+        copy_rows(**kwargs)
+        if not other_store.get_collection(name=compaction_collection).get(ids=[copy_chunk.id])["ids"]:
+            other_store.add_multiple_document_chunks(chunks=[copy_chunk], collection_name=compaction_collection)
+            other_store.delete_document(document_id="kept", collection_name=compaction_collection)
+
+    def _sync_copy_with_other_writes(**kwargs: Any) -> None:
+        swap_writer.start()
+        time.sleep(0.1)  # let the write miss the sync, it is then repeated once the collections are swapped
+        sync_copy(**kwargs)
+
+    monkeypatch.setattr(vector_store, "_copy_rows", _copy_rows_with_other_writes)
+    monkeypatch.setattr(vector_store, "_sync_copy", _sync_copy_with_other_writes)
+    old_id = vector_store.get_collection(name=compaction_collection).id
+    vector_store.delete_document(document_id="deleted", collection_name=compaction_collection)
+    vector_store.wait_compactions()
+    swap_writer.join()
+    other_store.wait_compactions()
+
+    collection = vector_store.get_collection(name=compaction_collection)
+    assert collection.id != old_id, "Expected collection rebuilt after deleting half of its chunks"
+    assert sorted(collection.get()["ids"]) == [copy_chunk.id, swap_chunk.id], "Expected writes of other process kept"
+    assert not _temporary_collections(vector_store=vector_store, name=compaction_collection)
+
+
+def test_compaction_not_recovered_while_running(
+    vector_store: VectorStore,
+    compaction_collection: str,
+    fresh_singleton: SingletonFactory,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    other_store = fresh_singleton(VectorStore, chromadb_in_memory=True)
+    copy_rows = vector_store._copy_rows
+
+    def _copy_rows_and_recover_in_other_process(**kwargs: Any) -> None:
+        copy_rows(**kwargs)
+        other_store.get_or_create_collection(name=compaction_collection)
+
+    monkeypatch.setattr(vector_store, "_copy_rows", _copy_rows_and_recover_in_other_process)
+    old_id = vector_store.get_collection(name=compaction_collection).id
+    vector_store.compact_collection(name=compaction_collection)
+    assert vector_store.get_collection(name=compaction_collection).id != old_id
+    assert vector_store.count(collection_name=compaction_collection) == COMPACTION_CHUNK_COUNT
+    assert not _temporary_collections(vector_store=vector_store, name=compaction_collection)
+
+
+def test_compaction_swap_rolled_back_without_copy(
+    vector_store: VectorStore, compaction_collection: str, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    sync_copy = vector_store._sync_copy
+
+    def _sync_copy_and_drop_copy(**kwargs: Any) -> None:
+        sync_copy(**kwargs)
+        vector_store.chromadb_client.delete_collection(name=f"{compaction_collection}{VectorStore.COMPACTING_SUFFIX}")
+
+    monkeypatch.setattr(vector_store, "_sync_copy", _sync_copy_and_drop_copy)
+    with pytest.raises(VectorStoreError):
+        vector_store.compact_collection(name=compaction_collection)
+    collection = vector_store.get_collection(name=compaction_collection)
+    assert collection.count() == COMPACTION_CHUNK_COUNT, "Expected live collection kept when its copy is missing"
+    assert not vector_store._is_leased(metadata=collection.metadata), "Expected lease released after the failure"
+    assert not _temporary_collections(vector_store=vector_store, name=compaction_collection)